@@ -1,3 +1,8 @@
+import bisect
+import os
+import xml.etree.ElementTree as ET
+from array import array
+
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -9,40 +14,830 @@ width_segments = [
 
 
 
+def _polyval(coeffs, delta_s, order=0):
+    """
+    Evaluate w(ds) = a + b*ds + c*ds^2 + d*ds^3 (or its 1st/2nd derivative)
+    with Horner's rule. coeffs is (..., 4) = (a, b, c, d), works on arrays.
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    a, b, c, d = coeffs[..., 0], coeffs[..., 1], coeffs[..., 2], coeffs[..., 3]
+
+    if order == 0:
+        return a + delta_s*(b + delta_s*(c + delta_s*d))
+    if order == 1:
+        return b + delta_s*(2*c + delta_s*3*d)
+    if order == 2:
+        return 2*c + 6*d*delta_s
+    raise ValueError(f"order must be 0, 1 or 2, got {order}")
+
+
+
+class WidthProfile:
+    """
+    Width polynomials of many lanes packed into flat float64 arrays
+    (instead of one dict per segment).
+
+    offsets[i]   sOffset of segment i
+    coeffs[i]    (a, b, c, d) of segment i
+    lane_ptr     segments of lane k are lane_ptr[k]:lane_ptr[k+1]
+    lane_ends    s where each lane stops (inf if not known)
+    """
+
+    def __init__(self, offsets, coeffs, lane_ptr, lane_ids=None, lane_ends=None):
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.float64)
+        self.coeffs = np.ascontiguousarray(coeffs, dtype=np.float64).reshape(-1, 4)
+        self.lane_ptr = np.ascontiguousarray(lane_ptr, dtype=np.int64)
+
+        n_lanes = len(self.lane_ptr) - 1
+        if lane_ids is None:
+            lane_ids = range(n_lanes)
+        self.lane_ids = list(lane_ids)
+        self.lane_index = {lane_id: k for k, lane_id in enumerate(self.lane_ids)}
+
+        if lane_ends is None:
+            lane_ends = np.inf
+        self.lane_ends = np.array(np.broadcast_to(lane_ends, (n_lanes,)), dtype=np.float64)
+
+        # Sanity checks, so lookups can trust the layout
+        if len(self.offsets) != len(self.coeffs) or self.lane_ptr[-1] != len(self.offsets):
+            raise ValueError("offsets, coeffs and lane_ptr do not describe the same segments")
+        if len(self.lane_ids) != n_lanes or len(self.lane_index) != n_lanes:
+            raise ValueError("need one unique lane id per lane")
+        if np.any(np.diff(self.lane_ptr) <= 0):
+            raise ValueError("every lane needs at least one width segment")
+
+        # Offsets have to go up inside a lane (they restart at lane boundaries)
+        step = np.diff(self.offsets)
+        step[self.lane_ptr[1:-1] - 1] = 0.0
+        if np.any(step < 0):
+            raise ValueError("sOffset values must be sorted within each lane")
+
+    @classmethod
+    def from_segments(cls, lanes, lane_ends=None):
+        """
+        Build from the dict form: either one list of segment dicts
+        (like width_segments) or {lane_id: list of segment dicts}.
+        """
+        if isinstance(lanes, dict):
+            lane_ids = list(lanes.keys())
+            segment_lists = list(lanes.values())
+        else:
+            lane_ids = None
+            segment_lists = [lanes]
+
+        counts = [len(segments) for segments in segment_lists]
+        total = sum(counts)
+
+        offsets = np.fromiter((seg["sOffset"] for segments in segment_lists for seg in segments),
+                              dtype=np.float64, count=total)
+        coeffs = np.fromiter((seg[key] for segments in segment_lists for seg in segments
+                              for key in ("a", "b", "c", "d")),
+                             dtype=np.float64, count=4*total).reshape(total, 4)
+        lane_ptr = np.concatenate(([0], np.cumsum(counts)))
+
+        return cls(offsets, coeffs, lane_ptr, lane_ids, lane_ends)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def n_lanes(self):
+        return len(self.lane_ptr) - 1
+
+    def lane_range(self, lane=None):
+        """(start, stop) segment indices of a lane (first lane if None)."""
+        k = 0 if lane is None else self.lane_index[lane]
+        return int(self.lane_ptr[k]), int(self.lane_ptr[k + 1])
+
+    def segment_ends(self):
+        """s where each segment stops: next sOffset, or the lane end for the last one."""
+        ends = np.empty_like(self.offsets)
+        ends[:-1] = self.offsets[1:]
+        ends[self.lane_ptr[1:] - 1] = self.lane_ends
+        return ends
+
+    def segments(self, lane=None):
+        """Back to the dict form (list of segment dicts) for one lane."""
+        start, stop = self.lane_range(lane)
+        return [{"sOffset": float(self.offsets[i]), "a": float(self.coeffs[i, 0]),
+                 "b": float(self.coeffs[i, 1]), "c": float(self.coeffs[i, 2]),
+                 "d": float(self.coeffs[i, 3])}
+                for i in range(start, stop)]
+
+    def locate(self, s_values, lane=None):
+        """
+        Index (into offsets/coeffs) of the segment used at each s.
+        Same rule as getLaneWidth: last segment starting at or before s,
+        1st segment if s is before all of them.
+        """
+        start, stop = self.lane_range(lane)
+        idx = np.searchsorted(self.offsets[start:stop], s_values, side='right') - 1
+        return start + np.clip(idx, 0, stop - start - 1)
+
+    def width(self, s_values, lane=None, order=0):
+        """Width (or its derivative) at each s, for one lane."""
+        s_values = np.asarray(s_values, dtype=np.float64)
+        idx = self.locate(s_values, lane)
+        return _polyval(self.coeffs[idx], s_values - self.offsets[idx], order)
+
+
+# Built once, used by everything below
+width_profile = WidthProfile.from_segments(width_segments)
+
+
+
 def getLaneWidth(s):
     """
     PART A: Calculate lane width at position s.
     """
     
-    # Find the right segment to use
-    segment_to_use = None
+    # Find the right segment (binary search on the packed offsets) and
+    # calculate width using polynomial formula
+    # w(s) = a + b*(s-sOffset) + c*(s-sOffset)^2 + d*(s-sOffset)^3
+    return float(width_profile.width(s))
+
+
+
+def getLaneWidths(s_values, profile=None, lane=None):
+    """
+    Batch version of getLaneWidth: array of s in, array of widths out.
+    """
+    if profile is None:
+        profile = width_profile
+
+    # searchsorted on the offsets + Horner's rule, see WidthProfile.width
+    return profile.width(s_values, lane)
+
+
+
+def adaptive_width_samples(s0, s1, tol=1e-3, profile=None, lane=None, max_rounds=60):
+    """
+    s values over [s0, s1] so that drawing straight lines between them stays
+    within tol of the real width (instead of a fixed np.linspace).
     
-    for segment in width_segments:
-        # Check if starts before or at pos s
-        if segment["sOffset"] <= s:
-            segment_to_use = segment
-        # If exceed pos s, stop.
-        else:
+    On [s_a, s_b] inside one segment, linear interpolation is off by at most
+    h^2/8 * max|w''| (h = s_b - s_a). w'' = 2c + 6d*ds is linear, so its max
+    is at one of the ends. Every segment start is a sample; intervals over
+    the bound are cut in half, all of them at once, until none is left.
+    Straight stretches keep just their ends.
+    """
+    if profile is None:
+        profile = width_profile
+    if tol <= 0:
+        raise ValueError(f"tol must be > 0, got {tol}")
+
+    start, stop = profile.lane_range(lane)
+    lo, hi = min(s0, s1), max(s0, s1)
+    inner = profile.offsets[start:stop]
+    samples = np.unique(np.concatenate(([lo, hi], inner[(inner > lo) & (inner < hi)])))
+
+    for _ in range(max_rounds):
+        a, b = samples[:-1], samples[1:]
+        idx = profile.locate(0.5*(a + b), lane)
+        curv = np.maximum(np.abs(_polyval(profile.coeffs[idx], a - profile.offsets[idx], 2)),
+                          np.abs(_polyval(profile.coeffs[idx], b - profile.offsets[idx], 2)))
+        split = (b - a)**2/8*curv > tol
+        if not split.any():
             break
+        samples = np.insert(samples, np.flatnonzero(split) + 1, 0.5*(a[split] + b[split]))
+
+    return samples
+
+
+
+def iter_xodr_lane_sections(path):
+    """
+    Stream the lane <width> records out of an OpenDRIVE (.xodr) file.
     
-    # If  s in before all segmenst (edge case). Use  1st segment
-    if segment_to_use is None:
-        segment_to_use = width_segments[0]
+    Uses iterparse and clears every element once it is read, so memory
+    does not grow with the file. Yields one laneSection at a time:
+    (road_id, section_s, section_length, [(lane_id, [(sOffset, a, b, c, d), ...]), ...])
+    sOffset stays relative to the start of the laneSection (like in the file).
+    Lanes without <width> (center lane, border-only lanes) are skipped.
+    """
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+
+    road_id = None
+    road_length = np.inf
+    section = None   # lanes of the laneSection being read
+    lane = None      # (lane_id, records) being read
+    pending = None   # finished laneSection, its length is known when the next one starts
+
+    for event, elem in context:
+        tag = elem.tag.rsplit('}', 1)[-1]  # drop the namespace if there is one
+
+        if event == "start":
+            # Attributes are already there at "start", children are not
+            if tag == "road":
+                road_id = elem.get("id")
+                road_length = float(elem.get("length", "inf"))
+            elif tag == "laneSection":
+                section_s = float(elem.get("s", 0.0))
+                if pending is not None:
+                    yield pending[0], pending[1], section_s - pending[1], pending[2]
+                    pending = None
+                section = []
+            elif tag == "lane" and section is not None:
+                lane = (int(elem.get("id")), [])
+                section.append(lane)
+            elif tag == "width" and lane is not None:
+                lane[1].append(tuple(float(elem.get(key, 0.0))
+                                     for key in ("sOffset", "a", "b", "c", "d")))
+            continue
+
+        if tag == "lane":
+            lane = None
+        elif tag == "laneSection":
+            pending = (road_id, section_s, [(lane_id, records) for lane_id, records in section if records])
+            section = None
+        elif tag == "road":
+            # Last laneSection of a road ends at the road length
+            if pending is not None:
+                yield pending[0], pending[1], road_length - pending[1], pending[2]
+                pending = None
+            root.clear()
+
+        elem.clear()
+
+
+
+def load_xodr_widths(path):
+    """
+    Read all lane widths of an OpenDRIVE file straight into a WidthProfile.
     
-    # Calculate width using polynomial formula
-    # w(s) = a + b*(s-sOffset) + c*(s-sOffset)^2 + d*(s-sOffset)^3
+    Lane ids are (road_id, laneSection s, lane id), lane_ends are the
+    laneSection lengths (so in the same local s as sOffset).
+    """
+    # array('d') grows in place without a Python float object per value
+    offsets = array('d')
+    coeffs = array('d')
+    lane_ptr = array('q', [0])
+    lane_ends = array('d')
+    lane_ids = []
+
+    for road_id, section_s, section_length, lanes in iter_xodr_lane_sections(path):
+        for lane_id, records in lanes:
+            for s_offset, a, b, c, d in records:
+                offsets.append(s_offset)
+                coeffs.extend((a, b, c, d))
+            lane_ptr.append(len(offsets))
+            lane_ends.append(section_length)
+            lane_ids.append((road_id, section_s, lane_id))
+
+    return WidthProfile(np.frombuffer(offsets, dtype=np.float64),
+                        np.frombuffer(coeffs, dtype=np.float64),
+                        np.frombuffer(lane_ptr, dtype=np.int64),
+                        lane_ids,
+                        np.frombuffer(lane_ends, dtype=np.float64))
+
+
+
+class WidthCursor:
+    """
+    getLaneWidth for an s that mostly moves forward (vehicle, sampler).
     
-    sOffset = segment_to_use["sOffset"]
-    a = segment_to_use["a"]
-    b = segment_to_use["b"]
-    c = segment_to_use["c"]
-    d = segment_to_use["d"]
+    Remembers the segment it used last time: going forward it only steps
+    ahead from there (amortized O(1)), going backward it falls back to a
+    binary search.
+    """
+
+    def __init__(self, profile=None, lane=None):
+        if profile is None:
+            profile = width_profile
+
+        start, stop = profile.lane_range(lane)
+        # Plain lists: scalar math on them is a lot faster than on numpy scalars
+        self.offsets = profile.offsets[start:stop].tolist()
+        self.coeffs = profile.coeffs[start:stop].tolist()
+        self.index = 0
+
+    def reset(self):
+        self.index = 0
+
+    def width(self, s):
+        offsets = self.offsets
+        i = self.index
+        last = len(offsets) - 1
+
+        if s >= offsets[i]:
+            # Moving forward: usually still in the same segment or the next one
+            if i < last and offsets[i + 1] <= s:
+                i += 1
+                # Big jump ahead, binary search the rest instead of stepping
+                if i < last and offsets[i + 1] <= s:
+                    i = bisect.bisect_right(offsets, s, lo=i + 1) - 1
+        else:
+            # Jumped backward (or before the 1st segment, then use the 1st one)
+            i = max(bisect.bisect_right(offsets, s, hi=i) - 1, 0)
+
+        self.index = i
+
+        a, b, c, d = self.coeffs[i]
+        delta_s = s - offsets[i]
+        return a + delta_s*(b + delta_s*(c + delta_s*d))
+
+    def sweep(self, s_values):
+        """Yield the width at each s, in order."""
+        for s in s_values:
+            yield self.width(s)
+
+
+
+def lane_boundaries(reference, left=(), right=(), profile=None):
+    """
+    Boundary polylines of the lanes next to a sampled reference line.
     
-    delta_s = s - sOffset
+    reference is (n, 4): s, x, y, heading per station (s in the same local s
+    as sOffset). left / right are lane keys of the profile, ordered from the
+    reference line outward. The widths of all lanes at all stations are
+    evaluated in one go and summed outward (np.cumsum), then every boundary is
+    reference point + offset * normal (OpenDRIVE: left of the heading is +).
+    Returns {lane: (inner, outer)}, both (n, 2) x/y vertex arrays. Neighbouring
+    lanes share the boundary between them (views of one (boundaries, n, 2) array).
+    """
+    if profile is None:
+        profile = width_profile
+
+    reference = np.asarray(reference, dtype=np.float64).reshape(-1, 4)
+    s_values, heading = reference[:, 0], reference[:, 3]
+    left, right = list(left), list(right)
+    lanes = left + right
+
+    # Segment of every (lane, station), then one Horner call for all of them
+    idx = np.array([profile.locate(s_values, lane) for lane in lanes], dtype=np.int64).reshape(len(lanes), len(s_values))
+    widths = _polyval(profile.coeffs[idx], s_values - profile.offsets[idx])
+
+    # Row 0 is the reference line itself, then the left and the right boundaries going outward
+    offsets = np.concatenate((np.zeros((1, len(s_values))),
+                              np.cumsum(widths[:len(left)], axis=0),
+                              -np.cumsum(widths[len(left):], axis=0)))
+    normal = np.column_stack((-np.sin(heading), np.cos(heading)))
+    points = reference[:, 1:3] + offsets[..., None]*normal
+
+    boundaries = {}
+    for k, lane in enumerate(left):
+        boundaries[lane] = (points[k], points[k + 1])
+    for k, lane in enumerate(right):
+        inner = 0 if k == 0 else len(left) + k
+        boundaries[lane] = (points[inner], points[len(left) + k + 1])
+    return boundaries
+
+
+
+class LaneBoundaryCache:
+    """
+    lane_boundaries for every laneSection of a map loaded with load_xodr_widths
+    (profile, its lane ids are (road_id, section_s, lane_id)), worked out the
+    first time a section is asked for and then kept.
     
-    width = a + b*delta_s + c*(delta_s**2) + d*(delta_s**3)
+    references is {road_id: (n, 4) array of s, x, y, heading}, s along the
+    road. A section uses the stations inside it, plus its start and end
+    (interpolated), so neighbouring sections meet without a gap.
+    """
+
+    def __init__(self, references, profile):
+        self.profile = profile
+        self.references = {road_id: np.asarray(ref, dtype=np.float64).reshape(-1, 4)
+                           for road_id, ref in references.items()}
+        self.cache = {}
+
+        # (road_id, section_s) -> [(lane_id, lane key, section length)]
+        self.sections = {}
+        for (road_id, section_s, lane_id), length in zip(profile.lane_ids, profile.lane_ends):
+            self.sections.setdefault((road_id, section_s), []).append(
+                (lane_id, (road_id, section_s, lane_id), float(length)))
+
+    def clear(self):
+        self.cache.clear()
+
+    def section(self, road_id, section_s):
+        """{lane id: (inner, outer)} for one laneSection, see lane_boundaries."""
+        key = (road_id, section_s)
+        if key in self.cache:
+            return self.cache[key]
+
+        lanes = self.sections[key]
+        ref = self.references[road_id]
+        s_end = min(section_s + lanes[0][2], ref[-1, 0])
+
+        # Stations inside the section + its exact start and end, in local s
+        s_road = ref[:, 0]
+        inside = s_road[(s_road > section_s) & (s_road < s_end)]
+        s_local = np.concatenate(([section_s], inside, [s_end]))
+        reference = np.column_stack((s_local - section_s,
+                                     np.interp(s_local, s_road, ref[:, 1]),
+                                     np.interp(s_local, s_road, ref[:, 2]),
+                                     np.interp(s_local, s_road, np.unwrap(ref[:, 3]))))
+
+        # OpenDRIVE ids: 1, 2, ... going left, -1, -2, ... going right
+        left = [lane_key for lane_id, lane_key, _ in sorted(lanes) if lane_id > 0]
+        right = [lane_key for lane_id, lane_key, _ in sorted(lanes, reverse=True) if lane_id < 0]
+        boundaries = lane_boundaries(reference, left, right, self.profile)
+
+        result = {lane_key[2]: pair for lane_key, pair in boundaries.items()}
+        self.cache[key] = result
+        return result
+
+
+
+def _critical_points(coeffs):
+    """
+    Roots of w'(ds) = b + 2c*ds + 3d*ds^2, shape (..., 2).
+    nan/inf where there is no (real) root.
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    A, B, C = 3*coeffs[..., 3], 2*coeffs[..., 2], coeffs[..., 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Stable quadratic formula, also gives the linear root when A = 0
+        q = -0.5*(B + np.where(B >= 0, 1.0, -1.0)*np.sqrt(B*B - 4*A*C))
+        return np.stack([q/A, C/q], axis=-1)
+
+
+
+def _cubic_range(coeffs, lo, hi):
+    """
+    Exact min and max of w(ds) = a + b*ds + c*ds^2 + d*ds^3 for ds in [lo, hi].
+    
+    The extremes are at the interval ends or where w'(ds) = b + 2c*ds + 3d*ds^2 = 0,
+    so only those (at most 4) points are evaluated. Works on arrays of segments.
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    lo, hi = np.broadcast_arrays(np.asarray(lo, dtype=float), np.asarray(hi, dtype=float))
+    roots = _critical_points(coeffs)
+
+    # Roots that are complex / outside the interval are replaced by lo
+    inside = (roots > lo[..., None]) & (roots < hi[..., None])
+    candidates = np.concatenate([lo[..., None], hi[..., None],
+                                 np.where(inside, roots, lo[..., None])], axis=-1)
+
+    values = _polyval(coeffs[..., None, :], candidates)
+    return values.min(axis=-1), values.max(axis=-1)
+
+
+
+class WidthRangeIndex:
+    """
+    Exact min/max width over any [s0, s1] in O(log n).
+    
+    Every segment's min/max over its own range is worked out once
+    (from the roots of its derivative, see _cubic_range) and stored in
+    a segment tree. A query then only needs the two partial segments at
+    the ends plus O(log n) tree nodes for the full segments in between.
+    """
+
+    def __init__(self, profile=None):
+        if profile is None:
+            profile = width_profile
+        self.profile = profile
+
+        offsets = profile.offsets
+        ends = profile.segment_ends()
+
+        # Last segment of a lane with unknown end is never fully inside a query
+        open_ended = np.isinf(ends)
+        lengths = np.where(open_ended, 0.0, ends - offsets)
+        seg_min, seg_max = _cubic_range(profile.coeffs, 0.0, lengths)
+        seg_min[open_ended] = np.inf
+        seg_max[open_ended] = -np.inf
+
+        # Leaves at [size, size + n), node i covers its children 2i and 2i+1
+        size = 1
+        while size < len(offsets):
+            size *= 2
+        self.size = size
+        self.tree_min = np.full(2*size, np.inf)
+        self.tree_max = np.full(2*size, -np.inf)
+        self.tree_min[size:size + len(offsets)] = seg_min
+        self.tree_max[size:size + len(offsets)] = seg_max
+
+        # Fill one level at a time, bottom up
+        level = size // 2
+        while level >= 1:
+            nodes = np.arange(level, 2*level)
+            self.tree_min[nodes] = np.minimum(self.tree_min[2*nodes], self.tree_min[2*nodes + 1])
+            self.tree_max[nodes] = np.maximum(self.tree_max[2*nodes], self.tree_max[2*nodes + 1])
+            level //= 2
+
+    def min_max(self, s0, s1, lane=None):
+        """
+        (min width, max width) over [s0, s1] of one lane.
+        s0 and s1 can be arrays (one query per pair), all queries are done together.
+        """
+        scalar = np.ndim(s0) == 0 and np.ndim(s1) == 0
+        s0, s1 = np.broadcast_arrays(np.atleast_1d(np.asarray(s0, dtype=float)),
+                                     np.atleast_1d(np.asarray(s1, dtype=float)))
+        lo, hi = np.minimum(s0, s1), np.maximum(s0, s1)
+
+        offsets = self.profile.offsets
+        coeffs = self.profile.coeffs
+        i0 = self.profile.locate(lo, lane)
+        i1 = self.profile.locate(hi, lane)
+        same = i0 == i1
+
+        # Partial segment where the query starts (the whole query if it is just one segment)
+        end0 = np.where(same, hi, offsets[np.minimum(i0 + 1, len(offsets) - 1)])
+        min0, max0 = _cubic_range(coeffs[i0], lo - offsets[i0], end0 - offsets[i0])
+
+        # Partial segment where the query stops
+        start1 = np.where(same, lo, offsets[i1])
+        min1, max1 = _cubic_range(coeffs[i1], start1 - offsets[i1], hi - offsets[i1])
+
+        # Full segments i0+1 .. i1-1 from the tree (iterative bottom-up walk)
+        result_min = np.minimum(min0, min1)
+        result_max = np.maximum(max0, max1)
+        left = i0 + 1 + self.size
+        right = i1 + self.size
+        while True:
+            active = left < right
+            if not active.any():
+                break
+
+            take = active & (left % 2 == 1)
+            result_min[take] = np.minimum(result_min[take], self.tree_min[left[take]])
+            result_max[take] = np.maximum(result_max[take], self.tree_max[left[take]])
+            left[take] += 1
+
+            take = active & (right % 2 == 1)
+            right[take] -= 1
+            result_min[take] = np.minimum(result_min[take], self.tree_min[right[take]])
+            result_max[take] = np.maximum(result_max[take], self.tree_max[right[take]])
+
+            left //= 2
+            right //= 2
+
+        if scalar:
+            return float(result_min[0]), float(result_max[0])
+        return result_min, result_max
+
+
+
+# One row per stretch of lane, see find_width_intervals
+interval_dtype = np.dtype([
+    ("lane", np.int64),       # lane position in the profile (profile.lane_ids[lane])
+    ("s_start", np.float64),
+    ("s_end", np.float64),
+])
+
+
+
+def find_width_intervals(threshold, below=True, profile=None, lane=None, s_max=None):
+    """
+    Every stretch of s where the width is below (or above, below=False)
+    threshold, for all lanes (or one lane).
     
-    return width
+    Exact: the crossings are the roots of w(s) - threshold, not samples.
+    Segments whose min/max (see _cubic_range) are all on one side are
+    decided without root finding. Lanes with no known end stop at s_max.
+    Returns a structured array (interval_dtype), sorted by lane and s.
+    """
+    if profile is None:
+        profile = width_profile
+
+    if lane is None:
+        segments = np.arange(len(profile))
+    else:
+        segments = np.arange(*profile.lane_range(lane))
+
+    offsets = profile.offsets[segments]
+    coeffs = profile.coeffs[segments]
+    ends = profile.segment_ends()[segments]
+    if s_max is not None:
+        ends = np.minimum(ends, s_max)
+    if np.any(np.isinf(ends)):
+        raise ValueError("lane end is not known, pass s_max")
+    lengths = np.maximum(ends - offsets, 0.0)
+
+    # w(ds) - threshold, as a cubic
+    shifted = coeffs.copy()
+    shifted[:, 0] -= threshold
+
+    # Pruning: segments that stay on one side need no roots
+    seg_min, seg_max = _cubic_range(shifted, 0.0, lengths)
+    crosses = (seg_min < 0) & (seg_max > 0)
+
+    # Split crossing segments at w' = 0, each piece is monotone so it
+    # has at most 1 root, found by bisection (all pieces at once)
+    cand = np.flatnonzero(crosses)
+    crit = np.sort(_critical_points(shifted[cand]), axis=1)
+    crit = np.where((crit > 0) & (crit < lengths[cand, None]), crit, lengths[cand, None])
+    crit = np.sort(crit, axis=1)
+    knots = np.concatenate([np.zeros((len(cand), 1)), crit, lengths[cand, None]], axis=1)
+
+    lo, hi = knots[:, :-1], knots[:, 1:]
+    f_lo = _polyval(shifted[cand, None, :], lo)
+    f_hi = _polyval(shifted[cand, None, :], hi)
+    has_root = f_lo*f_hi < 0
+
+    piece_seg, piece_k = np.nonzero(has_root)
+    coeffs_root = shifted[cand[piece_seg]]
+    lo, hi = lo[piece_seg, piece_k], hi[piece_seg, piece_k]
+    rising = f_lo[piece_seg, piece_k] < 0
+    for _ in range(60):
+        mid = 0.5*(lo + hi)
+        go_right = (_polyval(coeffs_root, mid) < 0) == rising
+        lo = np.where(go_right, mid, lo)
+        hi = np.where(go_right, hi, mid)
+
+    # Cut points per segment: its start, the roots, its end (padded with the end)
+    cuts = np.repeat(lengths[:, None], 5, axis=1)
+    cuts[:, 0] = 0.0
+    root_row = cand[piece_seg]
+    root_col = 1 + piece_k   # at most 1 root per monotone piece, pieces are in order
+    cuts[root_row, root_col] = 0.5*(lo + hi)
+    cuts[:, 1:4] = np.sort(cuts[:, 1:4], axis=1)
+
+    # Keep the pieces whose midpoint is on the wanted side
+    piece_lo, piece_hi = cuts[:, :-1], cuts[:, 1:]
+    side = _polyval(shifted[:, None, :], 0.5*(piece_lo + piece_hi))
+    keep = (side < 0 if below else side > 0) & (piece_hi > piece_lo)
+
+    seg_idx, _ = np.nonzero(keep)
+    starts = offsets[seg_idx] + piece_lo[keep]
+    stops = np.where(piece_hi[keep] == lengths[seg_idx], ends[seg_idx], offsets[seg_idx] + piece_hi[keep])
+    lanes = np.searchsorted(profile.lane_ptr, segments[seg_idx], side='right') - 1
+    if len(starts) == 0:
+        return np.empty(0, dtype=interval_dtype)
+
+    # Merge pieces that touch (same lane, one starts where the last one stopped)
+    new_run = np.ones(len(starts), dtype=bool)
+    new_run[1:] = (lanes[1:] != lanes[:-1]) | (starts[1:] > stops[:-1])
+    run_start = np.flatnonzero(new_run)
+
+    result = np.empty(len(run_start), dtype=interval_dtype)
+    result["lane"] = lanes[run_start]
+    result["s_start"] = starts[run_start]
+    result["s_end"] = stops[np.append(run_start[1:], len(starts)) - 1]
+    return result
+
+
+
+def _fit_run(coeffs, offsets, ends, samples=16):
+    """
+    One cubic (a, b, c, d) for a run of consecutive segments, ds measured
+    from offsets[0]. It goes exactly through the original width at both ends
+    of the run (so junctions stay as they were), c and d are a least squares
+    fit to samples of the original widths in between.
+    Returns (coeffs, max error), the error is exact (not sampled).
+    """
+    length = ends[-1] - offsets[0]
+    w_start = coeffs[0, 0]
+    w_end = _polyval(coeffs[-1], ends[-1] - offsets[-1])
+
+    # With u = ds/length: w = w_start + (w_end - w_start)*u + c'*(u^2 - u) + d'*(u^3 - u)
+    ds = np.linspace(0.0, 1.0, samples)*(ends - offsets)[:, None]
+    u = ((ds + (offsets - offsets[0])[:, None])/length).ravel()
+    rest = _polyval(coeffs[:, None, :], ds).ravel() - w_start - (w_end - w_start)*u
+    (c, d), *_ = np.linalg.lstsq(np.column_stack((u*u - u, u**3 - u)), rest, rcond=None)
+    c, d = c/length**2, d/length**3
+    fit = np.array([w_start, (w_end - w_start)/length - c*length - d*length**2, c, d])
+
+    # Move the fit to each segment's own ds (Taylor shift), the difference is a cubic
+    shift = offsets - offsets[0]
+    shifted = np.column_stack((_polyval(fit, shift), _polyval(fit, shift, 1),
+                               0.5*_polyval(fit, shift, 2), np.full(len(shift), d)))
+    error_min, error_max = _cubic_range(shifted - coeffs, 0.0, ends - offsets)
+    return fit, float(max(-error_min.min(), error_max.max()))
+
+
+
+def compact_widths(tol=0.01, profile=None, samples=16):
+    """
+    Merge runs of neighbouring segments into one cubic where the width
+    stays within tol (m) of the original everywhere.
+    
+    Greedy, lane by lane: each run is made as long as the re-fitted cubic
+    (_fit_run) is still within tol, found by galloping + binary search on
+    the run length (roughly n log n fits' worth of work). The fit keeps the width at
+    both ends of the run, so the junctions that are left keep their C0 gap
+    (none if there was none). A last segment with no known end is kept as is.
+    Returns (new WidthProfile, report) with report = {"segments_before",
+    "segments_after", "ratio", "max_error"}.
+    """
+    if profile is None:
+        profile = width_profile
+
+    offsets = profile.offsets
+    coeffs = profile.coeffs
+    ends = profile.segment_ends()
+
+    new_offsets, new_coeffs, lane_ptr = [], [], [0]
+    max_error = 0.0
+    for k in range(profile.n_lanes):
+        start, stop = int(profile.lane_ptr[k]), int(profile.lane_ptr[k + 1])
+        mergeable = stop - 1 if np.isinf(ends[stop - 1]) else stop
+
+        i = start
+        while i < stop:
+            # Longest run i .. i+good-1 that still fits: try 2, 4, 8, ... segments,
+            # then binary search between the last good and the first bad length
+            # (O(log m) fits per run instead of one per added segment)
+            best, best_error, good, bad = coeffs[i], 0.0, 1, None
+            longest = mergeable - i
+            length = 2
+            while good < longest:
+                length = min(length, longest)
+                fit, error = _fit_run(coeffs[i:i + length], offsets[i:i + length], ends[i:i + length], samples)
+                if error > tol:
+                    bad = length
+                    break
+                best, best_error, good = fit, error, length
+                length *= 2
+
+            while bad is not None and bad - good > 1:
+                length = (good + bad) // 2
+                fit, error = _fit_run(coeffs[i:i + length], offsets[i:i + length], ends[i:i + length], samples)
+                if error > tol:
+                    bad = length
+                else:
+                    best, best_error, good = fit, error, length
+
+            new_offsets.append(offsets[i])
+            new_coeffs.append(best)
+            max_error = max(max_error, best_error)
+            i += good
+        lane_ptr.append(len(new_offsets))
+
+    compacted = WidthProfile(new_offsets, new_coeffs, lane_ptr, profile.lane_ids, profile.lane_ends)
+    report = {
+        "segments_before": len(profile),
+        "segments_after": len(compacted),
+        "ratio": len(profile)/len(compacted),
+        "max_error": max_error,
+    }
+    return compacted, report
+
+
+
+# One row per junction, see audit_continuity
+junction_dtype = np.dtype([
+    ("lane", np.int64),            # lane position in the profile (profile.lane_ids[lane])
+    ("segment", np.int64),         # segment that starts at the junction
+    ("s", np.float64),             # junction position
+    ("width_before", np.float64),  # width from the segment that ends here
+    ("width_after", np.float64),   # width from the segment that starts here
+    ("gap", np.float64),           # C0: |width_before - width_after|
+    ("slope_before", np.float64),
+    ("slope_after", np.float64),
+    ("angle_diff", np.float64),    # C1: slope angle difference [deg]
+    ("curvature_jump", np.float64),  # C2: |w''_before - w''_after|
+    ("c0_ok", np.bool_),
+    ("c1_ok", np.bool_),
+    ("c2_ok", np.bool_),
+])
+
+
+
+def audit_continuity(profile=None, c0_tol=0.01, c1_tol=10.0, c2_tol=0.01, violations_only=True):
+    """
+    C0/C1/C2 check of every junction of every lane in one vectorized pass.
+    
+    Returns a structured array (junction_dtype), only the junctions that
+    break at least one tolerance unless violations_only=False.
+    c0_tol in m, c1_tol in degrees, c2_tol in 1/m.
+    """
+    if profile is None:
+        profile = width_profile
+
+    offsets = profile.offsets
+    coeffs = profile.coeffs
+
+    # Junction = start of every segment that is not the 1st one of its lane
+    first_of_lane = np.zeros(len(offsets), dtype=bool)
+    first_of_lane[profile.lane_ptr[:-1]] = True
+    after = np.flatnonzero(~first_of_lane)
+    before = after - 1
+
+    junction_s = offsets[after]
+    delta_s = junction_s - offsets[before]
+
+    # delta_s = 0 for the segment that starts at the junction: w = a, w' = b, w'' = 2c
+    width_before = _polyval(coeffs[before], delta_s)
+    width_after = coeffs[after, 0]
+    slope_before = _polyval(coeffs[before], delta_s, order=1)
+    slope_after = coeffs[after, 1]
+    curvature_before = _polyval(coeffs[before], delta_s, order=2)
+    curvature_after = 2*coeffs[after, 2]
+
+    report = np.empty(len(after), dtype=junction_dtype)
+    report["lane"] = np.searchsorted(profile.lane_ptr, after, side='right') - 1
+    report["segment"] = after
+    report["s"] = junction_s
+    report["width_before"] = width_before
+    report["width_after"] = width_after
+    report["gap"] = np.abs(width_before - width_after)
+    report["slope_before"] = slope_before
+    report["slope_after"] = slope_after
+    report["angle_diff"] = np.abs(np.degrees(np.arctan(slope_before) - np.arctan(slope_after)))
+    report["curvature_jump"] = np.abs(curvature_before - curvature_after)
+    report["c0_ok"] = report["gap"] < c0_tol
+    report["c1_ok"] = report["angle_diff"] < c1_tol
+    report["c2_ok"] = report["curvature_jump"] < c2_tol
+
+    if violations_only:
+        report = report[~(report["c0_ok"] & report["c1_ok"] & report["c2_ok"])]
+    return report
 
 
 
@@ -53,33 +848,27 @@ def check_continuity():
     We check two things:
     1. C0: Do the widths match at the junction?
     2. C1: Do the slopes match at the junction?
+    (plus C2: does the curvature w'' match?)
+    
+    The numbers come from audit_continuity, this just prints the
+    junction of the given segments.
     """
     
     print("\nCONTINUITY CHECK AT JUNCTION")
     
-    seg1 = width_segments[0]
-    seg2 = width_segments[1]
-    
     # Junction is where 2nd segment starts
-    junction_s = seg2["sOffset"]  # s = 20.0
+    junction = audit_continuity(c0_tol=0.01, c1_tol=10, violations_only=False)[0]
+    junction_s = float(junction["s"])  # s = 20.0
     
     # C0 CHECK: widths at junction
     print(f"\nC0 (Positional) Continuity at s={junction_s}:")
     
-    # Width from segment 1 at junction
-    delta_s1 = junction_s - seg1["sOffset"]
-    width_from_seg1 = seg1["a"] + seg1["b"]*delta_s1 + seg1["c"]*(delta_s1**2) + seg1["d"]*(delta_s1**3)
-    
-    # Width from segment 2 at junction (delta_s = 0 at start)
-    width_from_seg2 = seg2["a"]  # All are 0 when delta_s = 0
-    
-    gap = abs(width_from_seg1 - width_from_seg2)
-    
-    print(f"  Width from Segment 1: {width_from_seg1:.3f}m")
-    print(f"  Width from Segment 2: {width_from_seg2:.3f}m")
-    print(f"  Gap: {gap:.3f}m")
+    # Width from segment 1 at junction vs segment 2 (delta_s = 0 at its start)
+    print(f"  Width from Segment 1: {junction['width_before']:.3f}m")
+    print(f"  Width from Segment 2: {junction['width_after']:.3f}m")
+    print(f"  Gap: {junction['gap']:.3f}m")
     
-    if gap < 0.01:  # Within 1cm tolerance
+    if junction["c0_ok"]:  # Within 1cm tolerance
         print("  ✓ Continuous (no gap)")
     else:
         print("  ✗ Discontinuous (there's a gap)")
@@ -88,27 +877,24 @@ def check_continuity():
     print(f"\n~C1 (Directional) Continuity:")
     
     # Derivative formula: dw/ds = b + 2*c*(s-sOffset) + 3*d*(s-sOffset)^2
+    # Slope difference is converted to an angle difference
+    print(f"  Slope from Segment 1: {junction['slope_before']:.3f}")
+    print(f"  Slope from Segment 2: {junction['slope_after']:.3f}")
+    print(f"  Angle difference: {junction['angle_diff']:.1f}°")
     
-    # Slope from segment 1 at junction
-    delta_s1 = junction_s - seg1["sOffset"]
-    slope_from_seg1 = seg1["b"] + 2*seg1["c"]*delta_s1 + 3*seg1["d"]*(delta_s1**2)
-    
-    # Slope from segment 2 at junction (delta_s = 0)
-    slope_from_seg2 = seg2["b"]
-    
-    # Convert slope difference to angle difference
-    angle1 = np.arctan(slope_from_seg1) * 180 / np.pi  # Convert to degrees
-    angle2 = np.arctan(slope_from_seg2) * 180 / np.pi
-    angle_diff = abs(angle1 - angle2)
+    if junction["c1_ok"]:  # Within 10 degrees tolerance
+        print("  ✓ Approximately continuous")
+    else:
+        print("  ✗ Discontinuous (sharp change)")
     
-    print(f"  Slope from Segment 1: {slope_from_seg1:.3f}")
-    print(f"  Slope from Segment 2: {slope_from_seg2:.3f}")
-    print(f"  Angle difference: {angle_diff:.1f}°")
+    # C2 CHECK: second derivative d2w/ds2 = 2*c + 6*d*(s-sOffset)
+    print(f"\n~C2 (Curvature) Continuity:")
+    print(f"  Jump in w'': {junction['curvature_jump']:.4f} 1/m")
     
-    if angle_diff < 10:  # Within 10 degrees tolerance
+    if junction["c2_ok"]:
         print("  ✓ Approximately continuous")
     else:
-        print("  ✗ Discontinuous (sharp change)")
+        print("  ✗ Discontinuous (curvature jump)")
 
 
 
@@ -117,11 +903,11 @@ def plot_width_profile():
     PLOT 1: Show how lane width changes along the road.
     """
     
-    # Create points from s=0 to s=40
-    s_values = np.linspace(0, 40, 400)
+    # Points from s=0 to s=40, more of them where the width bends
+    s_values = adaptive_width_samples(0, 40, tol=1e-3)
     
-    # Calculate width at each point
-    width_values = [getLaneWidth(s) for s in s_values]
+    # Calculate width at each point (all at once)
+    width_values = getLaneWidths(s_values)
     
     # Create the plot
     plt.figure(figsize=(10, 6))
@@ -130,13 +916,13 @@ def plot_width_profile():
     plt.plot(s_values, width_values, 'b-', linewidth=2, label='Lane Width')
     
     # Mark segment boundaries with vertical lines
-    for segment in width_segments:
-        plt.axvline(x=segment["sOffset"], color='red', linestyle='--', alpha=0.7)
+    boundary_widths = getLaneWidths(width_profile.offsets)
+    for s_offset, width_at_boundary in zip(width_profile.offsets, boundary_widths):
+        plt.axvline(x=s_offset, color='red', linestyle='--', alpha=0.7)
         
         # Add width value at boundary
-        width_at_boundary = getLaneWidth(segment["sOffset"])
-        plt.plot(segment["sOffset"], width_at_boundary, 'ro', markersize=8)
-        plt.text(segment["sOffset"], width_at_boundary + 0.1, 
+        plt.plot(s_offset, width_at_boundary, 'ro', markersize=8)
+        plt.text(s_offset, width_at_boundary + 0.1, 
                 f'{width_at_boundary:.2f}m', ha='center')
     
     plt.xlabel('Position along road (s) [meters]')
@@ -154,30 +940,21 @@ def plot_continuity():
     PLOT 2: Zoom in on the junction to show continuity.
     """
     
-    junction_s = width_segments[1]["sOffset"]  # s = 20
+    offsets = width_profile.offsets
+    coeffs = width_profile.coeffs
     
-    # Create points around the junction
-    s_values = np.linspace(junction_s - 5, junction_s + 5, 200)
+    junction_s = float(offsets[1])  # s = 20
+    
+    # Create points around the junction (the junction itself is always one of them)
+    s_values = adaptive_width_samples(junction_s - 5, junction_s + 5, tol=1e-4)
     
     # Calculate widths using both segments
-    widths_seg1 = []
-    widths_seg2 = []
+    # Segment 1 formula (even beyond its range)
+    widths_seg1 = _polyval(coeffs[0], s_values - offsets[0])
     
-    for s in s_values:
-        # Segment 1 formula (even beyond its range)
-        delta_s1 = s - width_segments[0]["sOffset"]
-        w1 = width_segments[0]["a"] + width_segments[0]["b"]*delta_s1 + \
-             width_segments[0]["c"]*(delta_s1**2) + width_segments[0]["d"]*(delta_s1**3)
-        widths_seg1.append(w1)
-        
-        # Segment 2 formula
-        if s >= junction_s:
-            delta_s2 = s - width_segments[1]["sOffset"]
-            w2 = width_segments[1]["a"] + width_segments[1]["b"]*delta_s2 + \
-                 width_segments[1]["c"]*(delta_s2**2) + width_segments[1]["d"]*(delta_s2**3)
-            widths_seg2.append(w2)
-        else:
-            widths_seg2.append(np.nan)  # Not valid before junction
+    # Segment 2 formula, not valid before junction
+    widths_seg2 = _polyval(coeffs[1], s_values - offsets[1])
+    widths_seg2[s_values < junction_s] = np.nan
     
     # Create the plot
     plt.figure(figsize=(10, 6))
@@ -227,6 +1004,68 @@ def run_tests():
         actual = getLaneWidth(s)
         print(f"s={s:5.1f}: width={actual:.3f}m (expected ~{expected:.2f}m)")
 
+    # Batch version should give the same numbers
+    s_values = np.array([s for s, _ in test_cases] + [-5.0, 40.0])
+    batch = getLaneWidths(s_values)
+    single = np.array([getLaneWidth(s) for s in s_values])
+    print(f"getLaneWidths matches getLaneWidth: {np.allclose(batch, single)}")
+
+    # Packed WidthProfile should match the formula on the original dicts
+    by_hand = []
+    for s in s_values:
+        seg = width_segments[0] if s < width_segments[1]["sOffset"] else width_segments[1]
+        ds = s - seg["sOffset"]
+        by_hand.append(seg["a"] + seg["b"]*ds + seg["c"]*ds**2 + seg["d"]*ds**3)
+    print(f"WidthProfile matches width_segments: {np.allclose(batch, by_hand)}")
+
+    # Cursor sweeping forward (and jumping back) should agree too
+    cursor = WidthCursor()
+    swept = list(cursor.sweep(np.concatenate((s_values, s_values[::-1]))))
+    print(f"WidthCursor matches getLaneWidths: {np.allclose(swept, np.concatenate((batch, batch[::-1])))}")
+
+    # Same road read from the sample OpenDRIVE file
+    xodr_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample.xodr")
+    xodr_profile = load_xodr_widths(xodr_path)
+    from_file = getLaneWidths(s_values, xodr_profile, lane=("1", 0.0, 1))
+    print(f"sample.xodr: {xodr_profile.n_lanes} lanes, {len(xodr_profile)} width segments, "
+          f"lane 1 of road 1 matches: {np.allclose(from_file, batch)}")
+
+    # Exact min/max vs dense sampling
+    range_index = WidthRangeIndex()
+    s_dense = np.linspace(5.0, 35.0, 3001)
+    w_min, w_max = range_index.min_max(5.0, 35.0)
+    sampled = getLaneWidths(s_dense)
+    print(f"Width over [5, 35]: min={w_min:.4f}m max={w_max:.4f}m "
+          f"(sampled: {sampled.min():.4f}m / {sampled.max():.4f}m)")
+
+    # Where is the lane narrower than 4.6m? (w = 4.6 at s = 16 and s = 30)
+    narrow = find_width_intervals(4.6, below=True, s_max=40.0)
+    print("Width < 4.6m for s in: " + ", ".join(f"[{row['s_start']:.2f}, {row['s_end']:.2f}]" for row in narrow))
+    never = (len(find_width_intervals(1.0, s_max=40.0)), len(find_width_intervals(10.0, below=False, s_max=40.0)))
+    print(f"Stretches below 1m / above 10m (none expected): {never[0]} / {never[1]}")
+
+    # Same lane cut into 1m pieces (shifted exactly), compaction should give back the 2 segments
+    starts = np.arange(0.0, 40.0)
+    idx = width_profile.locate(starts)
+    delta_s = starts - width_profile.offsets[idx]
+    pieces = np.column_stack([_polyval(width_profile.coeffs[idx], delta_s),
+                              _polyval(width_profile.coeffs[idx], delta_s, order=1),
+                              0.5*_polyval(width_profile.coeffs[idx], delta_s, order=2),
+                              width_profile.coeffs[idx, 3]])
+    compacted, report = compact_widths(0.01, WidthProfile(starts, pieces, [0, len(starts)], lane_ends=40.0))
+    print(f"Compacted {report['segments_before']} -> {report['segments_after']} segments "
+          f"(ratio {report['ratio']:.0f}, max error {report['max_error']:.4f}m), "
+          f"sOffsets {compacted.offsets.tolist()}")
+
+    # Boundaries of road 1 (straight along x): lane 1 outer edge at y = w(s), lane -1 at y = -3.5
+    s_ref = np.linspace(0.0, 40.0, 81)
+    road_1 = np.column_stack((s_ref, s_ref, np.zeros_like(s_ref), np.zeros_like(s_ref)))
+    boundary_cache = LaneBoundaryCache({"1": road_1}, xodr_profile)
+    road_1_lanes = boundary_cache.section("1", 0.0)
+    print(f"Lane boundaries of road 1 match the widths: "
+          f"{np.allclose(road_1_lanes[1][1][:, 1], getLaneWidths(s_ref))} / "
+          f"{np.allclose(road_1_lanes[-1][1][:, 1], -3.5)}")
+
 # MAIN PROGRAM
 if __name__ == "__main__":
     print("TASK 1: LANE WIDTH EVALUATION")
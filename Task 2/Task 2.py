@@ -1,3 +1,7 @@
+import bisect
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -12,7 +16,460 @@ lanes = {
 # Expected answer (given)
 EXPECTED_SORTED_LANE_IDS = ["41", "39", "87", "65", "13"]
 
-def sort_lane_ids_right_to_left(lanes_dict):
+def lane_right_axis(endpoints):
+    """
+    Average forward direction of the lanes and the right direction
+    (forward rotated 90° clockwise). endpoints is (N, 2, 2): start/end of each lane.
+    """
+    endpoints = np.asarray(endpoints, dtype=float)
+
+    # Unit direction of every lane (zero-length lanes don't count)
+    directions = endpoints[:, 1] - endpoints[:, 0]
+    lengths = np.hypot(directions[:, 0], directions[:, 1])
+    valid = lengths > 0
+    if not valid.any():
+        raise ValueError("need at least one lane with non-zero length")
+
+    # Average all directions to get road direction, then normalize
+    forward = (directions[valid] / lengths[valid, None]).mean(axis=0)
+    forward /= np.hypot(forward[0], forward[1])
+
+    # If forward is (x, y), right is (y, -x)
+    right = np.array([forward[1], -forward[0]])
+    return forward, right
+
+
+
+def order_lanes_right_to_left(endpoints, lane_ids):
+    """
+    Array version of sort_lane_ids_right_to_left, no prints.
+    
+    endpoints: (N, 2, 2) array, endpoints[i] = (start point, end point) of lane i
+    lane_ids:  (N,) ids
+    Returns (ids sorted right to left, projection of each lane on the right axis
+    in the input order).
+    """
+    endpoints = np.asarray(endpoints, dtype=float)
+    lane_ids = np.asarray(lane_ids)
+
+    _, right = lane_right_axis(endpoints)
+
+    # Project lane centers onto the right axis (dot product)
+    centers = endpoints.mean(axis=1)
+    projections = centers @ right
+
+    # High to low = right to left (stable, same ties as list.sort)
+    order = np.argsort(-projections, kind='stable')
+    return lane_ids[order], projections
+
+
+
+def _order_sections(endpoints, section_offsets):
+    """
+    Segmented version of order_lanes_right_to_left: every section gets its
+    own forward/right axis, all sections are done with the same few array ops.
+    """
+    counts = np.diff(section_offsets)
+    section_of_lane = np.repeat(np.arange(len(counts)), counts)
+
+    # Unit direction of every lane (zero-length lanes don't count)
+    directions = endpoints[:, 1] - endpoints[:, 0]
+    lengths = np.hypot(directions[:, 0], directions[:, 1])
+    valid = lengths > 0
+    unit = np.zeros_like(directions)
+    unit[valid] = directions[valid] / lengths[valid, None]
+
+    # Average forward direction per section (sum is enough, it gets normalized)
+    forward_x = np.bincount(section_of_lane, weights=unit[:, 0], minlength=len(counts))
+    forward_y = np.bincount(section_of_lane, weights=unit[:, 1], minlength=len(counts))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = np.hypot(forward_x, forward_y)
+        forward_x, forward_y = forward_x / norm, forward_y / norm
+
+    # Right is (y, -x) of forward, project lane centers onto their section's axis
+    centers = endpoints.mean(axis=1)
+    projections = (centers[:, 0]*forward_y[section_of_lane]
+                   - centers[:, 1]*forward_x[section_of_lane])
+
+    # By section, then high to low projection (lexsort is stable)
+    order = np.lexsort((-projections, section_of_lane))
+    return order, projections
+
+
+
+def _order_sections_chunk(args):
+    """Process pool worker: one chunk of whole sections."""
+    endpoints, section_offsets = args
+    return _order_sections(endpoints, section_offsets)
+
+
+
+def order_sections_right_to_left(endpoints, section_offsets, workers=None, parallel_min_lanes=500_000):
+    """
+    Order the lanes of many road sections at once.
+    
+    endpoints:       (N, 2, 2) start/end points of all lanes, section after section
+    section_offsets: (S+1,) lanes of section k are section_offsets[k]:section_offsets[k+1]
+    
+    Returns (order, projections). order holds indices into endpoints: the lanes
+    of section k from right to left are order[section_offsets[k]:section_offsets[k+1]].
+    projections are in the input order (nan for sections with only zero-length lanes).
+    
+    Inputs with at least parallel_min_lanes lanes are split into chunks of
+    whole sections and spread over a process pool (workers processes,
+    all CPUs if None). workers=1 always stays in this process.
+    """
+    endpoints = np.asarray(endpoints, dtype=float)
+    section_offsets = np.asarray(section_offsets, dtype=np.int64)
+    n_lanes = len(endpoints)
+
+    if section_offsets[0] != 0 or section_offsets[-1] != n_lanes or np.any(np.diff(section_offsets) < 0):
+        raise ValueError("section_offsets must go from 0 to len(endpoints) without going down")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1 or n_lanes < parallel_min_lanes:
+        return _order_sections(endpoints, section_offsets)
+
+    # Cut into ~equal lane counts, but only between sections
+    targets = np.linspace(0, n_lanes, 4*workers + 1)
+    cuts = np.unique(np.searchsorted(section_offsets, targets))
+    cuts = np.unique(np.concatenate(([0], cuts, [len(section_offsets) - 1])))
+
+    chunks = []
+    for first, last in zip(cuts[:-1], cuts[1:]):
+        lane_start, lane_stop = section_offsets[first], section_offsets[last]
+        chunks.append((endpoints[lane_start:lane_stop],
+                       section_offsets[first:last + 1] - lane_start))
+
+    order = np.empty(n_lanes, dtype=np.int64)
+    projections = np.empty(n_lanes)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for first, (chunk_order, chunk_projections) in zip(cuts[:-1], pool.map(_order_sections_chunk, chunks)):
+            lane_start = section_offsets[first]
+            order[lane_start:lane_start + len(chunk_order)] = chunk_order + lane_start
+            projections[lane_start:lane_start + len(chunk_order)] = chunk_projections
+
+    return order, projections
+
+
+
+class SegmentGrid:
+    """
+    Uniform grid over the segments of a polyline, for nearest-segment lookups.
+    
+    Each segment is put in every cell its bounding box (grown by radius)
+    touches, long segments piece by piece (cell-sized pieces). So if a point has a segment within radius, that segment is
+    in the point's own cell, and the best of the cell is the true nearest.
+    Points with nothing within radius fall back to checking all segments.
+    """
+
+    def __init__(self, polyline, radius=None):
+        polyline = np.asarray(polyline, dtype=float)
+        self.seg_start = polyline[:-1]
+        self.seg_end = polyline[1:]
+        seg_lengths = np.hypot(*(self.seg_end - self.seg_start).T)
+
+        if radius is None:
+            radius = 4*max(np.median(seg_lengths), 1e-9)
+        self.radius = float(radius)
+        self.cell_size = self.radius
+
+        # Long segments are cut into pieces no longer than a cell, and each
+        # piece's (grown) bounding box is used instead of the whole segment's,
+        # so a long segment is in ~length/cell_size cells, not (length/cell_size)^2
+        extent = np.abs(self.seg_end - self.seg_start).max(axis=1)
+        n_pieces = np.maximum(np.ceil(extent / self.cell_size), 1).astype(np.int64)
+        piece_seg = np.repeat(np.arange(len(extent)), n_pieces)
+        k = np.arange(len(piece_seg)) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+        start = self.seg_start[piece_seg]
+        delta = self.seg_end[piece_seg] - start
+        p0 = start + (k / n_pieces[piece_seg])[:, None]*delta
+        p1 = np.where((k + 1 == n_pieces[piece_seg])[:, None], self.seg_end[piece_seg],
+                      start + ((k + 1) / n_pieces[piece_seg])[:, None]*delta)
+
+        # Cell range covered by each (grown) piece bounding box
+        low = np.minimum(p0, p1) - self.radius
+        high = np.maximum(p0, p1) + self.radius
+        cell_low = np.floor(low / self.cell_size).astype(np.int64)
+        cell_high = np.floor(high / self.cell_size).astype(np.int64)
+        span = cell_high - cell_low + 1
+
+        # One (cell, segment) entry per covered cell
+        per_piece = span[:, 0]*span[:, 1]
+        piece_ids = np.repeat(np.arange(len(span)), per_piece)
+        k = np.arange(len(piece_ids)) - np.repeat(np.cumsum(per_piece) - per_piece, per_piece)
+        cx = cell_low[piece_ids, 0] + k // span[piece_ids, 1]
+        cy = cell_low[piece_ids, 1] + k % span[piece_ids, 1]
+        seg_ids = piece_seg[piece_ids]
+
+        # CSR layout: sorted cell keys, segments of cell i are seg_ids[ptr[i]:ptr[i+1]]
+        # (pieces of one segment share cells, keep each (cell, segment) once)
+        keys = self._key(cx, cy)
+        order = np.lexsort((seg_ids, keys))
+        keys, seg_ids = keys[order], seg_ids[order]
+        unique = np.ones(len(keys), dtype=bool)
+        unique[1:] = (keys[1:] != keys[:-1]) | (seg_ids[1:] != seg_ids[:-1])
+        keys, seg_ids = keys[unique], seg_ids[unique]
+        self.cell_keys, first = np.unique(keys, return_index=True)
+        self.cell_ptr = np.append(first, len(keys))
+        self.cell_segments = seg_ids
+
+    @staticmethod
+    def _key(cx, cy):
+        # Pack two cell coordinates in one int64 (fine for +-2^31 cells)
+        return (cx << 32) ^ (cy & 0xFFFFFFFF)
+
+    def _distance(self, points, segments):
+        """Distance of points[i] to segment segments[i], and where along it (0..1)."""
+        a = self.seg_start[segments]
+        ab = self.seg_end[segments] - a
+        ap = points - a
+        ab_squared = np.einsum('ij,ij->i', ab, ab)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.clip(np.einsum('ij,ij->i', ap, ab) / ab_squared, 0.0, 1.0)
+        u = np.where(ab_squared > 0, u, 0.0)
+        offset = ap - u[:, None]*ab
+        return np.hypot(offset[:, 0], offset[:, 1]), u
+
+    def nearest(self, points):
+        """For every point: (nearest segment, position along it 0..1, distance)."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(points)
+        best_seg = np.zeros(n, dtype=np.int64)
+        best_u = np.zeros(n)
+        best_dist = np.full(n, np.inf)
+
+        # Candidates from each point's own cell
+        cells = np.floor(points / self.cell_size).astype(np.int64)
+        keys = self._key(cells[:, 0], cells[:, 1])
+        slot = np.clip(np.searchsorted(self.cell_keys, keys), 0, len(self.cell_keys) - 1)
+        found = self.cell_keys[slot] == keys
+        counts = np.where(found, self.cell_ptr[slot + 1] - self.cell_ptr[slot], 0)
+
+        point_ids = np.repeat(np.arange(n), counts)
+        k = np.arange(len(point_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        segments = self.cell_segments[self.cell_ptr[slot[point_ids]] + k]
+        dist, u = self._distance(points[point_ids], segments)
+
+        # Keep the closest candidate per point (sort by point, then distance)
+        order = np.lexsort((dist, point_ids))
+        first = order[np.unique(point_ids[order], return_index=True)[1]]
+        best_seg[point_ids[first]] = segments[first]
+        best_u[point_ids[first]] = u[first]
+        best_dist[point_ids[first]] = dist[first]
+
+        # Nothing within radius: check every segment (chunked to bound memory)
+        far = np.flatnonzero(best_dist > self.radius)
+        n_segments = len(self.seg_start)
+        chunk = max(1, 1_000_000 // n_segments)
+        for start in range(0, len(far), chunk):
+            ids = far[start:start + chunk]
+            pts = np.repeat(points[ids], n_segments, axis=0)
+            segs = np.tile(np.arange(n_segments), len(ids))
+            dist, u = self._distance(pts, segs)
+            dist, u = dist.reshape(len(ids), n_segments), u.reshape(len(ids), n_segments)
+            arg = dist.argmin(axis=1)
+            rows = np.arange(len(ids))
+            best_seg[ids], best_u[ids], best_dist[ids] = arg, u[rows, arg], dist[rows, arg]
+
+        return best_seg, best_u, best_dist
+
+
+
+def _resample(polyline, n_points):
+    """n_points evenly spaced (by arc length) along a polyline."""
+    steps = np.hypot(*np.diff(polyline, axis=0).T)
+    arc = np.concatenate(([0.0], np.cumsum(steps)))
+    stations = np.linspace(0.0, arc[-1], n_points)
+    return np.column_stack([np.interp(stations, arc, polyline[:, 0]),
+                            np.interp(stations, arc, polyline[:, 1])])
+
+
+
+def order_polylines_right_to_left(polylines, lane_ids, reference=None, radius=None, samples=32):
+    """
+    Right-to-left order for curved lanes given as polylines
+    (travel direction = first point -> last point).
+    
+    Instead of one global right axis, every lane is projected onto a shared
+    reference line (a lane's polyline, the longest one if not given), giving
+    station s and signed lateral offset t (t > 0 = left of the reference).
+    Lanes are compared by their median t over the stations all lanes cover,
+    so this also works on bends and roundabouts. Projections use a SegmentGrid
+    on the reference (radius = how far lanes are from it; if None, from the
+    distance of the lane end points to the reference).
+    
+    Returns (ids sorted right to left, lateral offset t of each lane in input order).
+    """
+    polylines = [np.asarray(polyline, dtype=float) for polyline in polylines]
+    lane_ids = np.asarray(lane_ids)
+
+    if reference is None:
+        lengths = [np.hypot(*np.diff(polyline, axis=0).T).sum() for polyline in polylines]
+        reference = polylines[int(np.argmax(lengths))]
+    reference = np.asarray(reference, dtype=float)
+
+    ref_steps = np.hypot(*np.diff(reference, axis=0).T)
+    ref_arc = np.concatenate(([0.0], np.cumsum(ref_steps)))
+    grid = SegmentGrid(reference, radius)
+    if radius is None:
+        # Grid radius from how far the lanes sit from the reference (their end points,
+        # plus a margin), otherwise most points miss their cell and check every segment
+        ends = np.concatenate([polyline[[0, -1]] for polyline in polylines])
+        spread = grid.nearest(ends)[2].max()
+        grid = SegmentGrid(reference, max(1.25*spread + grid.radius, grid.radius))
+
+    # Same number of evenly spaced points on every lane, all projected together
+    points = np.concatenate([_resample(polyline, samples) for polyline in polylines])
+    segment, u, _ = grid.nearest(points)
+
+    station = ref_arc[segment] + u*ref_steps[segment]
+    foot = grid.seg_start[segment] + u[:, None]*(grid.seg_end[segment] - grid.seg_start[segment])
+    tangent = grid.seg_end[segment] - grid.seg_start[segment]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tangent = tangent / np.hypot(tangent[:, 0], tangent[:, 1])[:, None]
+    offset = points - foot
+    lateral = tangent[:, 0]*offset[:, 1] - tangent[:, 1]*offset[:, 0]  # cross product, left = +
+
+    # Only stations every lane covers (all of them if the lanes do not overlap)
+    station = station.reshape(len(polylines), samples)
+    lateral = lateral.reshape(len(polylines), samples)
+    common_low = station.min(axis=1).max()
+    common_high = station.max(axis=1).min()
+    shared = (station >= common_low) & (station <= common_high)
+    if common_low > common_high or not shared.any(axis=1).all():
+        shared = np.ones_like(shared)
+
+    lane_offsets = np.nanmedian(np.where(shared, lateral, np.nan), axis=1)
+
+    # Most negative t = rightmost (stable for ties)
+    order = np.argsort(lane_offsets, kind='stable')
+    return lane_ids[order], lane_offsets
+
+
+
+class LaneOrderTracker:
+    """
+    Keeps the right-to-left order of a changing set of lanes (live perception).
+    
+    Only lanes that were added / moved get projected again, and they are put
+    back in place with a binary search on the sorted list. Finding the spot
+    is O(log n); the list insert / delete itself shifts the entries after it
+    (one memmove, O(n)), which is still only microseconds for the lane counts
+    of a live frame (~13 us per move at 10k lanes) and much cheaper than a
+    balanced tree in pure Python. The right axis
+    (from the average heading, like sort_lane_ids_right_to_left) is only
+    re-derived, with a full re-sort, when the average heading drifts more
+    than heading_tolerance degrees away from it.
+    Lane ids must be comparable (ties in projection are broken by id).
+    """
+
+    def __init__(self, heading_tolerance=2.0):
+        self.heading_tolerance = np.radians(heading_tolerance)
+        self.lanes = {}          # id -> (start, end)
+        self.units = {}          # id -> unit direction (0, 0 for zero-length lanes)
+        self.keys = {}           # id -> (-projection, id), high projection first
+        self.sorted_keys = []
+        self.direction_sum = np.zeros(2)
+        self.forward = None
+        self.right = None
+
+    def __len__(self):
+        return len(self.lanes)
+
+    def __contains__(self, lane_id):
+        return lane_id in self.lanes
+
+    def order(self):
+        """Lane ids from right to left."""
+        return [lane_id for _, lane_id in self.sorted_keys]
+
+    def projection(self, lane_id):
+        return -self.keys[lane_id][0]
+
+    def update(self, lane_id, start, end):
+        """Add a lane or move an existing one."""
+        if lane_id in self.lanes:
+            self._take_out(lane_id)
+
+        start = (float(start[0]), float(start[1]))
+        end = (float(end[0]), float(end[1]))
+        direction = np.subtract(end, start)
+        length = np.hypot(direction[0], direction[1])
+        unit = direction / length if length > 0 else np.zeros(2)
+
+        self.lanes[lane_id] = (start, end)
+        self.units[lane_id] = unit
+        self.direction_sum += unit
+
+        if self.right is None:
+            self._derive_axis()
+        else:
+            self._put_in(lane_id)
+            self._check_drift()
+
+    def remove(self, lane_id):
+        self._take_out(lane_id)
+        del self.lanes[lane_id], self.units[lane_id]
+        self._check_drift()
+
+    def apply(self, changed=None, removed=()):
+        """
+        One frame: changed is {lane_id: (start, end)} for new / moved lanes,
+        removed the ids that are gone. Returns the new order.
+        """
+        for lane_id in removed:
+            self.remove(lane_id)
+        for lane_id, (start, end) in (changed or {}).items():
+            self.update(lane_id, start, end)
+        return self.order()
+
+    def _put_in(self, lane_id):
+        start, end = self.lanes[lane_id]
+        center_x = (start[0] + end[0]) / 2
+        center_y = (start[1] + end[1]) / 2
+        key = (-(center_x*self.right[0] + center_y*self.right[1]), lane_id)
+        self.keys[lane_id] = key
+        bisect.insort(self.sorted_keys, key)
+
+    def _take_out(self, lane_id):
+        key = self.keys.pop(lane_id, None)
+        if key is not None:
+            del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+        self.direction_sum -= self.units[lane_id]
+
+    def _check_drift(self):
+        norm = np.hypot(self.direction_sum[0], self.direction_sum[1])
+        if norm == 0 or self.forward is None:
+            return
+        cos_angle = (self.direction_sum @ self.forward) / norm
+        if np.arccos(np.clip(cos_angle, -1.0, 1.0)) > self.heading_tolerance:
+            self._derive_axis()
+
+    def _derive_axis(self):
+        """New right axis from the current average heading, then re-sort everything."""
+        if not self.lanes:
+            return
+        # Fresh sum, so rounding from many += / -= does not pile up
+        self.direction_sum = np.sum(list(self.units.values()), axis=0)
+        norm = np.hypot(self.direction_sum[0], self.direction_sum[1])
+        if norm == 0:
+            return
+
+        self.forward = self.direction_sum / norm
+        self.right = np.array([self.forward[1], -self.forward[0]])
+
+        lane_ids = list(self.lanes.keys())
+        endpoints = np.array([self.lanes[lane_id] for lane_id in lane_ids])
+        projections = endpoints.mean(axis=1) @ self.right
+        self.keys = {lane_id: (-float(projection), lane_id)
+                     for lane_id, projection in zip(lane_ids, projections)}
+        self.sorted_keys = sorted(self.keys.values())
+
+
+
+def sort_lane_ids_right_to_left(lanes_dict, verbose=False):
     """
     Sort lanes from right to left when looking forward.
     
@@ -21,77 +478,53 @@ def sort_lane_ids_right_to_left(lanes_dict):
     2. Calculate right direction (perpendicular to forward)
     3. Project each lane onto the right axis
     4. Sort by projection (high to low = right to left)
+    
+    The work is done on arrays by order_lanes_right_to_left,
+    verbose=True prints the steps.
     """
+    lane_ids = list(lanes_dict.keys())
+    endpoints = np.array([lanes_dict[lane_id] for lane_id in lane_ids], dtype=float)
+
+    sorted_ids, projections = order_lanes_right_to_left(endpoints, lane_ids)
+    sorted_ids = sorted_ids.tolist()
+
+    if verbose:
+        print_sorting_steps(lane_ids, endpoints, projections, sorted_ids)
+
+    return sorted_ids
+
+
+
+def print_sorting_steps(lane_ids, endpoints, projections, sorted_ids):
+    """Print what sort_lane_ids_right_to_left did, step by step."""
     print("\nSORTING PROCESS:")
     print("="*40)
     
-    # STEP 1: Calculate forward direction for each lane
     print("\nStep 1: Calculate lane directions")
-    forward_vectors = []
-    
-    for lane_id, (start_point, end_point) in lanes_dict.items():
-        direction_x = end_point[0] - start_point[0]
-        direction_y = end_point[1] - start_point[1]
-        
-        length = np.sqrt(direction_x**2 + direction_y**2)
-        
-        # Normalize (make length = 1)
+    directions = endpoints[:, 1] - endpoints[:, 0]
+    lengths = np.hypot(directions[:, 0], directions[:, 1])
+    for lane_id, direction, length in zip(lane_ids, directions, lengths):
         if length > 0:
-            normalized_x = direction_x / length
-            normalized_y = direction_y / length
-            forward_vectors.append((normalized_x, normalized_y))
-            print(f"  Lane {lane_id}: direction = ({normalized_x:.3f}, {normalized_y:.3f})")
+            print(f"  Lane {lane_id}: direction = ({direction[0]/length:.3f}, {direction[1]/length:.3f})")
     
-    # STEP 2: Average all directions to get road direction
     print("\nStep 2: Calculate average forward direction")
-    avg_x = sum(vec[0] for vec in forward_vectors) / len(forward_vectors)
-    avg_y = sum(vec[1] for vec in forward_vectors) / len(forward_vectors)
-    
-    # Normalize the average
-    avg_length = np.sqrt(avg_x**2 + avg_y**2)
-    forward_x = avg_x / avg_length
-    forward_y = avg_y / avg_length
+    forward, right = lane_right_axis(endpoints)
+    print(f"  Average forward: ({forward[0]:.3f}, {forward[1]:.3f})")
     
-    print(f"  Average forward: ({forward_x:.3f}, {forward_y:.3f})")
-    
-    # STEP 3: Calculate right direction (90° clockwise)
     print("\nStep 3: Calculate right direction")
-    # If forward is (x, y), right is (y, -x)
-    right_x = forward_y
-    right_y = -forward_x
-    
-    print(f"  Right direction: ({right_x:.3f}, {right_y:.3f})")
-    
+    print(f"  Right direction: ({right[0]:.3f}, {right[1]:.3f})")
     # Verify perpendicular (dot product should be 0)
-    dot_product = forward_x * right_x + forward_y * right_y
-    print(f"  Verification (should be ~0): {dot_product:.6f}")
+    print(f"  Verification (should be ~0): {forward @ right:.6f}")
     
-    # STEP 4: Project each lane onto right axis
     print("\nStep 4: Project lanes onto right axis")
-    lane_projections = []
+    centers = endpoints.mean(axis=1)
+    for lane_id, center, projection in zip(lane_ids, centers, projections):
+        print(f"  Lane {lane_id}: center=({center[0]:.2f}, {center[1]:.2f}), projection={projection:.2f}")
     
-    for lane_id, (start_point, end_point) in lanes_dict.items():
-        # Use lane center as representative point
-        center_x = (start_point[0] + end_point[0]) / 2
-        center_y = (start_point[1] + end_point[1]) / 2
-        
-        # Project onto right direction (dot product)
-        projection = center_x * right_x + center_y * right_y
-        
-        lane_projections.append((lane_id, projection))
-        print(f"  Lane {lane_id}: center=({center_x:.2f}, {center_y:.2f}), projection={projection:.2f}")
-    
-    # STEP 5: Sort by projection (high to low = right to left)
     print("\nStep 5: Sort by projection (right to left)")
-    lane_projections.sort(key=lambda x: x[1], reverse=True)
-    
-    sorted_ids = []
-    for i, (lane_id, projection) in enumerate(lane_projections):
-        sorted_ids.append(lane_id)
-        position = "lane 1) rightmost" if i == 0 else "lane 5) leftmost" if i == len(lane_projections)-1 else f"lane {i+1}"
+    for i, lane_id in enumerate(sorted_ids):
+        position = "lane 1) rightmost" if i == 0 else "lane 5) leftmost" if i == len(sorted_ids)-1 else f"lane {i+1}"
         print(f"  {i+1}. Lane {lane_id} ({position})")
-    
-    return sorted_ids
 
 def visualize_lanes(lanes_dict, sorted_ids):    
 
@@ -162,7 +595,7 @@ def visualize_lanes(lanes_dict, sorted_ids):
 if __name__ == "__main__":
         
     # Sort the lanes
-    sorted_lane_ids = sort_lane_ids_right_to_left(lanes)
+    sorted_lane_ids = sort_lane_ids_right_to_left(lanes, verbose=True)
     
     # Print results
     print("\n" + "-"*50)
@@ -176,6 +609,15 @@ if __name__ == "__main__":
     else:
         print("\n✗ The sorting doesn't match expected result")
     
+    # Same lanes through the batch (many sections) API, as one section
+    lane_ids = list(lanes.keys())
+    order, _ = order_sections_right_to_left(np.array([lanes[lane_id] for lane_id in lane_ids]), [0, len(lane_ids)])
+    print(f"Batch API order:       {[lane_ids[i] for i in order]}")
+    
+    # Live version: feed the lanes one frame at a time
+    tracker = LaneOrderTracker()
+    print(f"Tracker order:         {tracker.apply(changed=lanes)}")
+    
     # Create visualization
     print("\nGenerating visualization...")
     visualize_lanes(lanes, sorted_lane_ids)
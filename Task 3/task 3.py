@@ -1,3 +1,9 @@
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -25,13 +31,159 @@ lane_b = [
 ]
 
 
-def remove_duplicates(polyline):
-    """Remove consecutive duplicate points"""
-    cleaned = [polyline[0]]
-    for point in polyline[1:]:
-        if not np.allclose(point, cleaned[-1]):
-            cleaned.append(point)
-    return cleaned
+def remove_duplicates(polyline, tol=1e-8):
+    """Remove consecutive duplicate points
+    
+    A point is dropped when it is within tol of the last point kept, so a
+    slow trace is thinned to about tol spacing instead of lost, and jitter
+    around a standing point goes. The last point always stays, since it is
+    a fixed endpoint: if it is a near duplicate, the kept points within tol
+    before it are dropped instead. Returns an (N, D) array.
+    """
+    pts = np.asarray(polyline, dtype=float)
+    keep = _duplicate_mask(pts, np.array([0, len(pts)]), tol)
+    return pts[keep]
+
+
+
+def _duplicate_mask(points, offsets, tol):
+    """
+    remove_duplicates for many lanes in one buffer (lane k is
+    points[offsets[k]:offsets[k+1]]): mask of the points to keep.
+    
+    A step > tol from a kept point keeps the next point, that part is one
+    np.diff + mask. Only after a dropped point is the last kept point
+    needed, so only the dropped stretches are walked point by point.
+    """
+    n = len(points)
+    keep = np.ones(n, dtype=bool)
+    if n < 2:
+        return keep
+    
+    sizes = np.diff(offsets)
+    lane_starts = offsets[:-1][sizes > 0]
+    lane_ends = offsets[1:][sizes > 0] - 1
+    
+    # Right wherever the point before was kept (first point of a lane always is)
+    keep[1:] = np.linalg.norm(np.diff(points, axis=0), axis=1) > tol
+    keep[lane_starts] = True
+    
+    # Walk the dropped stretches in order, each measured from the last kept point.
+    # Plain Python floats: a numpy call per step costs more than the math here
+    # (one flat list per coordinate, a list per point would keep the GC busy).
+    dropped = np.flatnonzero(~keep)
+    if len(dropped):
+        columns = [points[:, k].tolist() for k in range(points.shape[1])]
+        rows = lambda i: [column[i] for column in columns]
+        walked_to = 0
+        for first, lane_end in zip(dropped.tolist(),
+                                   lane_ends[np.searchsorted(lane_ends, dropped)].tolist()):
+            if first < walked_to:
+                continue   # decided by an earlier stretch already
+            anchor = rows(first - 1)   # everything before first is settled, first - 1 is kept
+            i = first
+            while i <= lane_end and math.dist(rows(i), anchor) <= tol:
+                i += 1
+            keep[first:i] = False
+            if i <= lane_end:
+                keep[i] = True
+            walked_to = i + 1
+    
+    # Last point of every lane stays, the kept points within tol before it go instead
+    dropped_end = ~keep[lane_ends]
+    for lane_start, lane_end in zip(lane_starts[dropped_end], lane_ends[dropped_end]):
+        kept = lane_start + np.flatnonzero(keep[lane_start:lane_end])
+        far = np.linalg.norm(points[kept] - points[lane_end], axis=1) > tol
+        # The kept points after the last far one are close, except the lane's first point
+        close = kept[len(np.trim_zeros(far.astype(np.int8), 'b')):]
+        keep[close[close > lane_start]] = False
+        keep[lane_end] = True
+    
+    return keep
+
+
+
+def resample_polyline(polyline, spacing):
+    """
+    Evenly spaced points along a polyline (by arc length), endpoints kept.
+    The spacing ends up slightly under `spacing` so it fits the length exactly.
+    Needs no duplicate points (run remove_duplicates first).
+    """
+    pts = np.asarray(polyline, dtype=float)
+    if len(pts) < 2:
+        return pts.copy()
+    
+    # Cumulative length at every point, then interpolate each coordinate
+    arc = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(pts, axis=0), axis=1))))
+    n_steps = max(int(np.ceil(arc[-1] / spacing)), 1)
+    stations = np.linspace(0.0, arc[-1], n_steps + 1)
+    
+    return np.column_stack([np.interp(stations, arc, pts[:, k]) for k in range(pts.shape[1])])
+
+
+
+def adaptive_resample(polyline, tol=0.01, max_spacing=None, max_rounds=60):
+    """
+    Resample a polyline with spacing that follows its curvature: a chord of
+    length h on an arc of curvature k is off by about h^2*k/8, so h may be up
+    to sqrt(8*tol/k). Tight bends get dense points, straight parts a few
+    (never further apart than max_spacing, default: the whole length).
+    
+    Curvature is the discrete one at every vertex (circle through it and its
+    two neighbours). Points per meter sqrt(k/(8*tol)) is summed along the arc,
+    and the samples are placed at equal steps of that sum (np.interp), endpoints
+    kept. Chords that still miss an original vertex by more than tol are
+    split afterwards. Needs no duplicate points (run remove_duplicates first).
+    """
+    pts = np.asarray(polyline, dtype=float)
+    if len(pts) < 3:
+        return pts.copy()
+    
+    steps = np.diff(pts, axis=0)
+    lengths = np.linalg.norm(steps, axis=1)
+    arc = np.concatenate(([0.0], np.cumsum(lengths)))
+    if max_spacing is None:
+        max_spacing = arc[-1]
+    
+    # Circle through 3 points: k = 2*|a x b| / (|a| |b| |a + b|), any dimension
+    a, b = steps[:-1], steps[1:]
+    la, lb = lengths[:-1], lengths[1:]
+    cross = np.sqrt(np.maximum((la*lb)**2 - np.einsum('ij,ij->i', a, b)**2, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curvature = np.nan_to_num(2*cross / (la*lb*np.linalg.norm(a + b, axis=1)), nan=0.0)
+    curvature = np.concatenate(([curvature[0]], curvature, [curvature[-1]]))
+    
+    # Samples needed per meter, integrated along the arc (trapezoids)
+    density = np.maximum(np.sqrt(curvature / (8*tol)), 1.0 / max_spacing)
+    count = np.concatenate(([0.0], np.cumsum(0.5*(density[1:] + density[:-1])*lengths)))
+    
+    n_steps = max(int(np.ceil(count[-1])), 1)
+    stations = np.interp(np.linspace(0.0, count[-1], n_steps + 1), count, arc)
+    
+    # The bound assumes one curvature along the whole chord, which is not true
+    # where a straight part runs into a bend. So check every original vertex
+    # against the chord it falls under and cut the chords still off by > tol in half.
+    for _ in range(max_rounds):
+        resampled = np.column_stack([np.interp(stations, arc, pts[:, k]) for k in range(pts.shape[1])])
+        chord = np.clip(np.searchsorted(stations, arc, side='right') - 1, 0, len(stations) - 2)
+        worst = np.zeros(len(stations) - 1)
+        np.maximum.at(worst, chord, paired_segment_distance(pts, resampled[chord], resampled[chord + 1]))
+        split = worst > tol
+        if not split.any():
+            break
+        stations = np.insert(stations, np.flatnonzero(split) + 1,
+                             0.5*(stations[:-1][split] + stations[1:][split]))
+    
+    return resampled
+
+
+
+def preprocess_lane(polyline, tol=1e-8, spacing=None):
+    """Clean up a raw trace: drop near duplicates, optionally resample to even spacing."""
+    pts = remove_duplicates(polyline, tol)
+    if spacing is not None:
+        pts = resample_polyline(pts, spacing)
+    return pts
 
 
 
@@ -56,63 +208,601 @@ def point_to_segment_distance(point, seg_start, seg_end):
 
 
 
-def calculate_max_deviation(original, smoothed):
-    """Calculate maximum deviation using proper distance metric"""
-    max_dev = 0
+def points_to_segments_distance(points, seg_starts, seg_ends):
+    """
+    Distance from every point to every segment, as a (points, segments) array.
+    Same math as point_to_segment_distance, with broadcasting.
+    """
+    points = np.asarray(points, dtype=float)
+    a = np.asarray(seg_starts, dtype=float)
+    ab = np.asarray(seg_ends, dtype=float) - a
     
-    for point in smoothed:
-        # Find minimum distance to any segment in original
-        min_dist = float('inf')
-        for i in range(len(original) - 1):
-            dist = point_to_segment_distance(point, original[i], original[i+1])
-            min_dist = min(min_dist, dist)
-        max_dev = max(max_dev, min_dist)
-    return max_dev
+    ap = points[:, None, :] - a[None, :, :]
+    
+    # Project point onto line segment (t = 0 for degenerate segments)
+    ab_squared = np.einsum('ij,ij->i', ab, ab)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.einsum('pij,ij->pi', ap, ab) / ab_squared
+    t = np.where(ab_squared > 0, np.clip(t, 0, 1), 0.0)
+    
+    offset = ap - t[:, :, None]*ab[None, :, :]
+    return np.sqrt(np.einsum('pij,pij->pi', offset, offset))
+
 
 
+def paired_segment_distance(points, seg_starts, seg_ends):
+    """Distance from points[i] to segment (seg_starts[i], seg_ends[i]), row by row."""
+    ab = seg_ends - seg_starts
+    ap = points - seg_starts
+    ab_squared = np.einsum('ij,ij->i', ab, ab)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.einsum('ij,ij->i', ap, ab) / ab_squared
+    t = np.where(ab_squared > 0, np.clip(t, 0, 1), 0.0)
+    offset = ap - t[:, None]*ab
+    return np.sqrt(np.einsum('ij,ij->i', offset, offset))
 
-def smooth_lane(lane, max_deviation=0.3):
-    """Part A: Smooth lane with fixed endpoints - keep smoothing until we hit the limit"""
+
+
+class SegmentIndex:
+    """
+    Uniform grid over the segments of a set of polylines, built once,
+    for nearest-segment and within-radius queries.
     
-    lane = remove_duplicates(lane)
-    print(f"Removed duplicates, now have {len(lane)} points")
+    The grid is on x, y (extra coordinates like z only count in the
+    distances). Each segment is stored in the cells along it (long ones
+    are cut into cell-sized pieces first). Nearest search looks at rings of cells around the point and
+    stops once the best distance so far is closer than any unseen cell.
+    Segments are numbered across all polylines in order: polyline[k] and
+    segment[k] say where segment k came from.
+    """
+
+    def __init__(self, polylines, cell_size=None, max_rings=8):
+        if isinstance(polylines, np.ndarray) and polylines.ndim == 2:
+            polylines = [polylines]
+        polylines = [np.asarray(polyline, dtype=float) for polyline in polylines]
+        
+        self.starts = np.concatenate([polyline[:-1] for polyline in polylines])
+        self.ends = np.concatenate([polyline[1:] for polyline in polylines])
+        counts = [len(polyline) - 1 for polyline in polylines]
+        self.polyline = np.repeat(np.arange(len(polylines)), counts)
+        self.segment = np.arange(len(self.starts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        self.max_rings = max_rings
+        
+        low = np.minimum(self.starts[:, :2], self.ends[:, :2])
+        high = np.maximum(self.starts[:, :2], self.ends[:, :2])
+        if cell_size is None:
+            cell_size = np.median((high - low).max(axis=1))
+            if not cell_size > 0:
+                cell_size = max(float((high.max(axis=0) - low.min(axis=0)).max()), 1.0)
+        self.cell_size = float(cell_size)
+        
+        self.grid_low = np.floor(low.min(axis=0) / self.cell_size).astype(np.int64)
+        self.grid_high = np.floor(high.max(axis=0) / self.cell_size).astype(np.int64)
+        
+        # Long segments (a GPS gap) are cut into pieces no longer than a cell,
+        # each piece goes in the cells of its own bounding box (at most 2 x 2).
+        # So a segment is in ~length/cell_size cells, not (length/cell_size)^2.
+        n_pieces = np.maximum(np.ceil((high - low).max(axis=1) / self.cell_size), 1).astype(np.int64)
+        piece_seg = np.repeat(np.arange(len(low)), n_pieces)
+        k = np.arange(len(piece_seg)) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+        start = self.starts[piece_seg, :2]
+        delta = self.ends[piece_seg, :2] - start
+        p0 = start + (k / n_pieces[piece_seg])[:, None]*delta
+        p1 = np.where((k + 1 == n_pieces[piece_seg])[:, None], self.ends[piece_seg, :2],
+                      start + ((k + 1) / n_pieces[piece_seg])[:, None]*delta)
+        cell_low = np.floor(np.minimum(p0, p1) / self.cell_size).astype(np.int64)
+        cell_high = np.floor(np.maximum(p0, p1) / self.cell_size).astype(np.int64)
+        
+        # One (cell, segment) entry per cell a piece's bounding box touches
+        span = cell_high - cell_low + 1
+        per_piece = span[:, 0]*span[:, 1]
+        piece_ids = np.repeat(np.arange(len(span)), per_piece)
+        k = np.arange(len(piece_ids)) - np.repeat(np.cumsum(per_piece) - per_piece, per_piece)
+        cx = cell_low[piece_ids, 0] + k // span[piece_ids, 1]
+        cy = cell_low[piece_ids, 1] + k % span[piece_ids, 1]
+        seg_ids = piece_seg[piece_ids]
+        
+        # CSR layout: segments of cell_keys[i] are cell_segments[cell_ptr[i]:cell_ptr[i+1]]
+        # (pieces of one segment can share a cell, keep it once)
+        keys = self._key(cx, cy)
+        order = np.lexsort((seg_ids, keys))
+        keys, seg_ids = keys[order], seg_ids[order]
+        unique = np.ones(len(keys), dtype=bool)
+        unique[1:] = (keys[1:] != keys[:-1]) | (seg_ids[1:] != seg_ids[:-1])
+        keys, seg_ids = keys[unique], seg_ids[unique]
+        self.cell_keys, first = np.unique(keys, return_index=True)
+        self.cell_ptr = np.append(first, len(keys))
+        self.cell_segments = seg_ids
+
+    def __len__(self):
+        return len(self.starts)
+
+    @staticmethod
+    def _key(cx, cy):
+        # Two cell coordinates packed in one int64
+        return (cx << 32) ^ (cy & 0xFFFFFFFF)
+
+    def _cells(self, points):
+        return np.floor(points[:, :2] / self.cell_size).astype(np.int64)
+
+    def _candidates(self, point_ids, cx, cy):
+        """(point id, segment id) for every segment stored in cell (cx, cy) of each point."""
+        keys = self._key(cx, cy)
+        slot = np.clip(np.searchsorted(self.cell_keys, keys), 0, len(self.cell_keys) - 1)
+        counts = np.where(self.cell_keys[slot] == keys, self.cell_ptr[slot + 1] - self.cell_ptr[slot], 0)
+        
+        pid = np.repeat(point_ids, counts)
+        k = np.arange(len(pid)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return pid, self.cell_segments[np.repeat(self.cell_ptr[slot], counts) + k]
+
+    def nearest(self, points):
+        """Nearest segment and its distance, for every point."""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        n = len(points)
+        best_seg = np.zeros(n, dtype=np.int64)
+        best_dist = np.full(n, np.inf)
+        
+        cells = self._cells(points)
+        # Rings closer than this are empty (point outside the grid)
+        first_ring = np.maximum(np.maximum(self.grid_low - cells, cells - self.grid_high), 0).max(axis=1)
+        last_ring = np.maximum(np.abs(cells - self.grid_low), np.abs(cells - self.grid_high)).max(axis=1)
+        
+        todo = np.flatnonzero(first_ring <= self.max_rings)
+        ring = 0
+        while len(todo) and ring <= self.max_rings:
+            # Cells with Chebyshev distance = ring from the point's cell
+            steps = np.arange(-ring, ring + 1)
+            dx, dy = np.meshgrid(steps, steps, indexing='ij')
+            edge = np.maximum(np.abs(dx), np.abs(dy)) == ring
+            dx, dy = dx[edge], dy[edge]
+            
+            pid, seg = self._candidates(np.repeat(todo, len(dx)),
+                                        np.repeat(cells[todo, 0], len(dx)) + np.tile(dx, len(todo)),
+                                        np.repeat(cells[todo, 1], len(dy)) + np.tile(dy, len(todo)))
+            if len(pid):
+                dist = paired_segment_distance(points[pid], self.starts[seg], self.ends[seg])
+                order = np.lexsort((dist, pid))
+                first = order[np.unique(pid[order], return_index=True)[1]]
+                better = dist[first] < best_dist[pid[first]]
+                best_seg[pid[first][better]] = seg[first][better]
+                best_dist[pid[first][better]] = dist[first][better]
+            
+            # Anything not seen yet is at least ring cells away
+            done = (best_dist[todo] <= ring*self.cell_size) | (ring >= last_ring[todo])
+            todo = todo[~done]
+            ring += 1
+        
+        # Far from everything (or in a big empty area): check all segments
+        rest = np.flatnonzero(np.isinf(best_dist) | (first_ring > self.max_rings))
+        rest = np.union1d(rest, todo)
+        rows = max(1, 1_000_000 // len(self.starts))
+        for start in range(0, len(rest), rows):
+            ids = rest[start:start + rows]
+            dist = points_to_segments_distance(points[ids], self.starts, self.ends)
+            best_seg[ids] = dist.argmin(axis=1)
+            best_dist[ids] = dist[np.arange(len(ids)), best_seg[ids]]
+        
+        return best_seg, best_dist
+
+    def nearest_one(self, point):
+        """Nearest segment and its distance for a single point."""
+        seg, dist = self.nearest(np.asarray(point, dtype=float)[None])
+        return int(seg[0]), float(dist[0])
+
+    def within(self, points, radius):
+        """
+        All (point, segment) pairs closer than radius.
+        Returns (point ids, segment ids, distances), sorted by point then segment.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        cells = self._cells(points)
+        
+        reach = int(np.ceil(radius / self.cell_size))
+        steps = np.arange(-reach, reach + 1)
+        dx, dy = (d.ravel() for d in np.meshgrid(steps, steps, indexing='ij'))
+        
+        pid, seg = self._candidates(np.repeat(np.arange(len(points)), len(dx)),
+                                    np.repeat(cells[:, 0], len(dx)) + np.tile(dx, len(points)),
+                                    np.repeat(cells[:, 1], len(dy)) + np.tile(dy, len(points)))
+        
+        # A segment can sit in several of the cells, keep each pair once
+        pair = np.unique(pid*len(self.starts) + seg)
+        pid, seg = pair // len(self.starts), pair % len(self.starts)
+        
+        dist = paired_segment_distance(points[pid], self.starts[seg], self.ends[seg])
+        close = dist <= radius
+        return pid[close], seg[close], dist[close]
+
+    def within_one(self, point, radius):
+        """Segments closer than radius to a single point: (segment ids, distances)."""
+        _, seg, dist = self.within(np.asarray(point, dtype=float)[None], radius)
+        return seg, dist
+
+
+
+def calculate_max_deviation(original, smoothed, bound=None, chunk_size=1_000_000, index=None):
+    """Calculate maximum deviation using proper distance metric
     
-    pts = [np.array(p) for p in lane]
-    original = pts.copy()
+    All point-to-segment distances are computed with broadcasting, a block
+    of points at a time (at most chunk_size distances in memory).
+    If bound is given, stops at the first block with a point further than
+    bound and returns that block's max: it only tells you "> bound" then.
+    index: a SegmentIndex built on original, then only nearby segments are checked.
+    """
+    original = np.asarray(original, dtype=float)
+    smoothed = np.asarray(smoothed, dtype=float)
     
-    # Remember the endpoints (they must stay fixed)
-    first_point = pts[0].copy()
-    last_point = pts[-1].copy()
+    if index is not None:
+        return float(index.nearest(smoothed)[1].max())
     
-    # Keep smoothing until we can't anymore
-    iteration = 0
-    max_iterations = 20  # safety limit to prevent infinite loop
+    if len(original) == 1:
+        seg_starts = seg_ends = original  # single point, one degenerate segment
+    else:
+        seg_starts, seg_ends = original[:-1], original[1:]
+    
+    rows = max(1, chunk_size // len(seg_starts))
+    max_dev = 0.0
     
-    while iteration < max_iterations:
-        iteration += 1
-        new_pts = pts.copy()
+    for start in range(0, len(smoothed), rows):
+        # Minimum distance to any segment in original, per point
+        block = points_to_segments_distance(smoothed[start:start + rows], seg_starts, seg_ends)
+        max_dev = max(max_dev, float(block.min(axis=1).max()))
+        
+        if bound is not None and max_dev > bound:
+            break
+    return max_dev
+
+
+
+class DeviationTracker:
+    """
+    Max deviation of a smoothed lane from its original, done incrementally
+    (for the smoothing loop, where points only move a little each pass).
+    
+    Every point remembers the original segment it was closest to last time
+    and is only compared with the segments within `window` of that one.
+    Points whose best segment is at the edge of their window, or that look
+    further away than bound, get a full check against all segments: in
+    blocks of at most chunk_size distances, or with a SegmentIndex on
+    original (index, built here once the check gets bigger than chunk_size).
+    The smoothed lane must have the same number of points as the original.
+    
+    The answer to "is it <= bound" is exact. The value itself is exact for
+    the rechecked points and an upper bound (the best distance inside the
+    window) for the others.
+    """
+
+    def __init__(self, original, window=3, index=None, chunk_size=1_000_000):
+        original = np.asarray(original, dtype=float)
+        self.seg_starts = original[:-1]
+        self.seg_ends = original[1:]
+        self.n_segments = len(self.seg_starts)
+        self.window = window
+        self.index = index
+        self.chunk_size = chunk_size
+        
+        # Point j of the original sits on segments j-1 and j
+        self.home = np.minimum(np.arange(len(original)), self.n_segments - 1)
+        self.distance = np.zeros(len(original))
+
+    def max_deviation(self, points, bound=None):
+        points = np.asarray(points, dtype=float)
         
-        # Smooth interior points only
-        for j in range(1, len(pts) - 1):
-            # average with neighbors
-            avg = (pts[j-1] + pts[j+1]) / 2
-            new_pts[j] = 0.5 * pts[j] + 0.5 * avg
+        # Only the segments around each point's home segment
+        steps = np.arange(-self.window, self.window + 1)
+        candidates = np.clip(self.home[:, None] + steps[None, :], 0, self.n_segments - 1)
+        dist = paired_segment_distance(np.repeat(points, len(steps), axis=0),
+                                       self.seg_starts[candidates.ravel()],
+                                       self.seg_ends[candidates.ravel()]).reshape(candidates.shape)
+        best = dist.argmin(axis=1)
+        rows = np.arange(len(points))
+        self.home = candidates[rows, best]
+        self.distance = dist[rows, best]
         
-        # Make sure endpoints didn't move
-        new_pts[0] = first_point
-        new_pts[-1] = last_point
+        # Best one at the window edge (and the lane goes on): could be closer outside
+        at_edge = (((best == 0) & (self.home > 0))
+                   | ((best == len(steps) - 1) & (self.home < self.n_segments - 1)))
+        recheck = at_edge
+        if bound is not None:
+            recheck = recheck | (self.distance > bound)
         
-        # Check deviation using proper metric
-        deviation = calculate_max_deviation(original, new_pts)
+        # Full check for those points only
+        recheck = np.flatnonzero(recheck)
+        if len(recheck):
+            if self.index is None and len(recheck)*self.n_segments > self.chunk_size:
+                # Too many for a brute force check: grid on the original, built once
+                self.index = SegmentIndex([np.concatenate((self.seg_starts, self.seg_ends[-1:]))])
+            if self.index is not None:
+                seg, seg_dist = self.index.nearest(points[recheck])
+            else:
+                # A block of points at a time, like calculate_max_deviation
+                seg = np.empty(len(recheck), dtype=np.int64)
+                seg_dist = np.empty(len(recheck))
+                rows = max(1, self.chunk_size // self.n_segments)
+                for start in range(0, len(recheck), rows):
+                    block = points_to_segments_distance(points[recheck[start:start + rows]],
+                                                        self.seg_starts, self.seg_ends)
+                    seg[start:start + rows] = block.argmin(axis=1)
+                    seg_dist[start:start + rows] = block[np.arange(len(block)), seg[start:start + rows]]
+            self.home[recheck] = seg
+            self.distance[recheck] = seg_dist
         
-        if deviation <= max_deviation:
-            pts = new_pts
-            print(f"Iteration {iteration}: deviation = {deviation:.4f} - continuing")
+        return float(self.distance.max())
+
+
+
+def simplify_polyline(polyline, max_deviation=0.3):
+    """
+    Douglas-Peucker: drop points the lane shape does not need.
+    
+    Keeps both endpoints, and every original point stays within
+    max_deviation of the simplified polyline (point-to-segment distance,
+    same metric as smooth_lane). Uses an explicit stack instead of
+    recursion, so long traces cannot hit the recursion limit.
+    """
+    pts = np.asarray(polyline, dtype=float)
+    if len(pts) < 3:
+        return pts.copy()
+    
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        
+        # Distance of the points in between to the chord first -> last
+        inner = pts[first + 1:last]
+        dist = points_to_segments_distance(inner, pts[first:first + 1], pts[last:last + 1])[:, 0]
+        worst = int(dist.argmax())
+        
+        if dist[worst] > max_deviation:
+            split = first + 1 + worst
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    
+    return pts[keep]
+
+
+
+def laplacian_passes(points, passes, step=0.5, mu=None):
+    """
+    Run Laplacian smoothing passes on an (N, D) array, endpoints stay fixed.
+    
+    One pass moves every interior point by step towards the average of its
+    neighbours, all at once (step=0.5 is the "halfway" from Part A).
+    With mu (negative, |mu| a bit bigger than step, e.g. step=0.5, mu=-0.53)
+    each pass is a Taubin pair: a step pass then a mu pass, so the lane
+    does not shrink.
+    """
+    pts = np.array(points, dtype=float)
+    for _ in range(passes):
+        pts[1:-1] += step * ((pts[:-2] + pts[2:]) / 2 - pts[1:-1])
+        if mu is not None:
+            pts[1:-1] += mu * ((pts[:-2] + pts[2:]) / 2 - pts[1:-1])
+    return pts
+
+
+
+def smooth_points(points, max_deviation=0.3, max_iterations=20, step=0.5, mu=None, verbose=False):
+    """
+    Array engine for smooth_lane: the most passes (up to max_iterations,
+    None = up to 65536) that keep the deviation within max_deviation.
+    
+    Instead of checking after every pass it tries 1, 2, 4, 8, ... passes until
+    one goes over the limit, then binary searches between the last good and
+    the first bad count, so only O(log passes) deviation checks are needed.
+    (This assumes more passes never means less deviation, which holds for
+    the smoothing here in practice.) Without a limit it also stops once
+    doubling the passes no longer moves the points (by 1e-3 * max_deviation).
+    Returns (smoothed (N, D) array, passes, deviation).
+    """
+    original = np.array(points, dtype=float)
+    if len(original) < 3:
+        return original, 0, 0.0
+    
+    tracker = DeviationTracker(original)
+    # "No limit" still stops at 2^16 passes: a lane whose straight chord is within
+    # max_deviation never goes over it, and long lanes take ~N^2 passes to settle
+    limit = max_iterations if max_iterations is not None else 1 << 16
+    
+    good_passes, good_pts, good_dev = 0, original, 0.0
+    bad_passes = None
+    
+    def try_passes(passes):
+        # Always continue from the last good state, never from scratch
+        candidate = laplacian_passes(good_pts, passes - good_passes, step, mu)
+        deviation = tracker.max_deviation(candidate, bound=max_deviation)
+        if verbose:
+            verdict = "ok" if deviation <= max_deviation else f"too much (> {max_deviation})"
+            print(f"Passes {passes}: deviation = {deviation:.4f} - {verdict}")
+        return candidate, deviation
+    
+    # Exponential search: 1, 2, 4, ... (capped at the limit)
+    passes = 1
+    while True:
+        passes = min(passes, limit)
+        candidate, deviation = try_passes(passes)
+        if deviation > max_deviation:
+            bad_passes = passes
+            break
+        moved = np.abs(candidate - good_pts).max()
+        good_passes, good_pts, good_dev = passes, candidate, deviation
+        # Points have settled (e.g. a lane whose straight chord is within the
+        # limit): more passes change nothing, so stop instead of doubling on
+        if passes == limit or moved <= 1e-3*max_deviation:
+            break
+        passes *= 2
+    
+    # Binary search between the last good and the first bad count
+    while bad_passes is not None and bad_passes - good_passes > 1:
+        passes = (good_passes + bad_passes) // 2
+        candidate, deviation = try_passes(passes)
+        if deviation > max_deviation:
+            bad_passes = passes
         else:
-            print(f"Iteration {iteration}: deviation = {deviation:.4f} - STOPPED (would exceed {max_deviation})")
+            good_passes, good_pts, good_dev = passes, candidate, deviation
+    
+    return good_pts, good_passes, good_dev
+
+
+
+def _second_difference_bands(n):
+    """
+    Bands of K = D^T D for the (n-2) x n second difference matrix D
+    (rows 1, -2, 1): main diagonal, 1st and 2nd off-diagonal.
+    """
+    k0, k1, k2 = np.zeros(n), np.zeros(max(n - 1, 0)), np.zeros(max(n - 2, 0))
+    rows = np.arange(max(n - 2, 0))
+    for i, ci in enumerate((1.0, -2.0, 1.0)):
+        np.add.at(k0, rows + i, ci*ci)
+        for j, cj in enumerate((1.0, -2.0, 1.0)):
+            if j == i + 1:
+                np.add.at(k1, rows + i, ci*cj)
+            elif j == i + 2:
+                np.add.at(k2, rows + i, ci*cj)
+    return k0, k1, k2
+
+
+
+def _solve_pentadiagonal(d0, d1, d2, rhs):
+    """
+    Solve A x = rhs for a symmetric positive definite pentadiagonal A
+    (main diagonal d0, off-diagonals d1, d2), rhs can be (n, D).
+    Banded LDL^T, O(n).
+    """
+    n = len(d0)
+    # Plain Python floats: these loops are scalar, numpy per element is slower
+    d0, d1, d2 = d0.tolist(), d1.tolist(), d2.tolist()
+    diag, l1, l2 = [0.0]*n, [0.0]*n, [0.0]*n   # D, L[i+1, i], L[i+2, i]
+    
+    # Factor
+    for i in range(n):
+        value = d0[i]
+        if i >= 1:
+            value -= l1[i-1]*l1[i-1]*diag[i-1]
+        if i >= 2:
+            value -= l2[i-2]*l2[i-2]*diag[i-2]
+        diag[i] = value
+        if i + 1 < n:
+            off = d1[i]
+            if i >= 1:
+                off -= l2[i-1]*l1[i-1]*diag[i-1]
+            l1[i] = off / value
+        if i + 2 < n:
+            l2[i] = d2[i] / value
+    
+    # Forward, scale, backward, one column of rhs at a time
+    rhs = np.asarray(rhs, dtype=float)
+    columns = rhs.reshape(n, -1).T.tolist()
+    for x in columns:
+        for i in range(1, n):
+            x[i] -= l1[i-1]*x[i-1]
+            if i >= 2:
+                x[i] -= l2[i-2]*x[i-2]
+        for i in range(n):
+            x[i] /= diag[i]
+        for i in range(n - 2, -1, -1):
+            x[i] -= l1[i]*x[i+1]
+            if i + 2 < n:
+                x[i] -= l2[i]*x[i+2]
+    return np.array(columns).T.reshape(rhs.shape)
+
+
+
+def smooth_points_direct(points, max_deviation=0.3, iterations=40):
+    """
+    Direct smoothing: one linear solve instead of many averaging passes.
+    
+    Minimizes  sum |x_i - p_i|^2 + weight * sum |x_{i-1} - 2 x_i + x_{i+1}|^2
+    with both endpoints fixed. That is a pentadiagonal system, solved in O(N).
+    A bigger weight gives a smoother lane that is further from the original,
+    so the weight is bisected (on a log scale) to be just inside max_deviation.
+    Returns (smoothed (N, D) array, weight, deviation).
+    """
+    original = np.array(points, dtype=float)
+    n = len(original)
+    if n < 3:
+        return original, 0.0, 0.0
+    
+    k0, k1, k2 = _second_difference_bands(n)
+    tracker = DeviationTracker(original)
+    
+    # Endpoints are known, move their part to the right hand side
+    fixed = np.zeros_like(original)
+    fixed[0], fixed[-1] = original[0], original[-1]
+    coupling = k0[:, None]*fixed
+    coupling[:-1] += k1[:, None]*fixed[1:]
+    coupling[1:] += k1[:, None]*fixed[:-1]
+    coupling[:-2] += k2[:, None]*fixed[2:]
+    coupling[2:] += k2[:, None]*fixed[:-2]
+    
+    def solve(weight):
+        interior = _solve_pentadiagonal(1.0 + weight*k0[1:-1], weight*k1[1:-1], weight*k2[1:-1],
+                                        original[1:-1] - weight*coupling[1:-1])
+        pts = original.copy()
+        pts[1:-1] = interior
+        return pts, tracker.max_deviation(pts, bound=max_deviation)
+    
+    # Bracket: grow the weight until it goes over the limit
+    low, high = 0.0, 1e-3
+    best = (original, 0.0, 0.0)
+    while True:
+        pts, deviation = solve(high)
+        if deviation > max_deviation:
             break
+        best = (pts, high, deviation)
+        low = high
+        if high > 1e12:
+            return best  # even (almost) straight is within the limit
+        high *= 10
+    
+    # Bisection on log(weight)
+    for _ in range(iterations):
+        mid = np.sqrt(low*high) if low > 0 else high / 10
+        pts, deviation = solve(mid)
+        if deviation > max_deviation:
+            high = mid
+        else:
+            low = mid
+            best = (pts, mid, deviation)
+        if low > 0 and high / low < 1.001:
+            break
+    
+    return best
+
+
+
+def smooth_lane(lane, max_deviation=0.3, max_iterations=20, step=0.5, mu=None, method="laplacian",
+                spacing=None):
+    """Part A: Smooth lane with fixed endpoints - keep smoothing until we hit the limit
+    
+    Runs on an (N, 3) array (smooth_points): each pass is one slice
+    expression, and the number of passes is found by search instead of
+    checking after every pass. max_iterations=None lets it go as far as the
+    limit allows (up to 65536 passes), step/mu as in laplacian_passes.
+    method="direct" uses smooth_points_direct (one banded solve per try) instead.
+    spacing: resample the lane to even spacing first (see preprocess_lane).
+    """
+    
+    lane = preprocess_lane(lane, spacing=spacing)
+    print(f"Removed duplicates, now have {len(lane)} points")
     
-    if iteration == max_iterations:
+    if method == "direct":
+        pts, weight, deviation = smooth_points_direct(lane, max_deviation)
+        print(f"Direct solve: weight = {weight:.4g}, deviation = {deviation:.4f}")
+        return [tuple(p) for p in pts]
+    if method != "laplacian":
+        raise ValueError(f"method must be 'laplacian' or 'direct', got {method!r}")
+    
+    # Endpoints stay fixed (interior points only are moved)
+    pts, passes, deviation = smooth_points(lane, max_deviation, max_iterations, step, mu, verbose=True)
+    print(f"Using {passes} passes: deviation = {deviation:.4f}")
+    
+    if passes == max_iterations:
         print(f"Stopped at maximum iterations ({max_iterations})")
     
     return [tuple(p) for p in pts]
@@ -120,43 +810,356 @@ def smooth_lane(lane, max_deviation=0.3):
 
 
 
+# Worker side of smooth_lanes_parallel: the shared point buffer of this process
+_shared_points = {}
+
+
+
+def _attach_shared_points(name, shape):
+    """Pool initializer: map the shared buffer once per worker process."""
+    buffer = shared_memory.SharedMemory(name=name)
+    _shared_points["buffer"] = buffer
+    _shared_points["points"] = np.ndarray(shape, dtype=np.float64, buffer=buffer.buf)
+
+
+
+def _smooth_lane_slices(task):
+    """Smooth some lanes of the shared buffer in place, return (passes, deviation) per lane."""
+    starts, stops, max_deviation, max_iterations, step, mu = task
+    points = _shared_points["points"]
+    
+    results = []
+    for start, stop in zip(starts, stops):
+        smoothed, passes, deviation = smooth_points(points[start:stop], max_deviation,
+                                                    max_iterations, step, mu)
+        points[start:stop] = smoothed
+        results.append((passes, deviation))
+    return results
+
+
+
+def smooth_lanes_parallel(points, offsets, max_deviation=0.3, max_iterations=20, step=0.5, mu=None,
+                          workers=None, tol=1e-8):
+    """
+    smooth_lane for a whole map on a process pool.
+    
+    points: all lanes back to back in one (N, D) array, lane k is
+    points[offsets[k]:offsets[k+1]]. Near duplicates are removed first
+    (so offsets change), then the points go into one shared memory buffer.
+    Workers smooth their lanes in place there with smooth_points (fixed
+    endpoints, max_deviation), so only lane ranges and two numbers per lane
+    are sent between processes. workers=1 runs in this process (no shared memory).
+    Returns (smoothed points, new offsets, passes per lane, deviation per lane).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    
+    keep = _duplicate_mask(points, offsets, tol)
+    points = np.ascontiguousarray(points[keep])
+    offsets = np.concatenate(([0], np.cumsum(keep)))[offsets]
+    n_lanes = len(offsets) - 1
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    # Chunks of whole lanes with about the same number of points
+    n_chunks = max(1, min(n_lanes, 4*workers))
+    cuts = np.searchsorted(offsets, np.linspace(0, len(points), n_chunks + 1))
+    cuts = np.unique(np.concatenate(([0], np.clip(cuts, 0, n_lanes), [n_lanes])))
+    tasks = [(offsets[first:last], offsets[first + 1:last + 1], max_deviation, max_iterations, step, mu)
+             for first, last in zip(cuts[:-1], cuts[1:])]
+    
+    if workers == 1:
+        _shared_points["points"] = points
+        try:
+            results = [_smooth_lane_slices(task) for task in tasks]
+        finally:
+            _shared_points.clear()
+        smoothed = points
+    else:
+        buffer = shared_memory.SharedMemory(create=True, size=max(points.nbytes, 1))
+        try:
+            shared = np.ndarray(points.shape, dtype=np.float64, buffer=buffer.buf)
+            shared[...] = points
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_points,
+                                     initargs=(buffer.name, points.shape)) as pool:
+                results = list(pool.map(_smooth_lane_slices, tasks))
+            smoothed = shared.copy()
+            del shared  # no views left, or the buffer cannot be closed
+        finally:
+            buffer.close()
+            buffer.unlink()
+    
+    per_lane = [result for chunk in results for result in chunk]
+    passes = np.array([p for p, _ in per_lane], dtype=np.int64)
+    deviations = np.array([d for _, d in per_lane], dtype=np.float64)
+    return smoothed, offsets, passes, deviations
+
+
+
+def stream_smooth(points, lag=5, max_deviation=0.3, passes=None, step=0.5, tol=1e-8):
+    """
+    Online smooth_lane for a live point feed (generator).
+    
+    Takes points one at a time (any iterable, can be endless) and yields
+    each smoothed point lag points after it came in. Only the last
+    2*lag + 1 raw points are kept (ring buffer). Each point gets the same
+    Laplacian passes as smooth_lane, run on the window around it with the
+    window ends held fixed, and keeps the most passes (up to passes,
+    default lag - 1) that stay within max_deviation of the raw segments in
+    the window. Near duplicates (within tol) are dropped on the way in, the
+    very first and last points come out unchanged.
+    """
+    if passes is None:
+        passes = max(lag - 1, 1)
+    
+    window = deque(maxlen=2*lag + 1)
+    received = 0   # raw points taken in (after dropping duplicates)
+    emitted = 0    # points yielded so far
+    previous = None
+    
+    def smooth_one(index):
+        raw = np.array(window)
+        center = index - (received - len(raw))
+        if center == 0 or center == len(raw) - 1:
+            return tuple(raw[center])  # window end (or lane end): stays fixed
+        
+        best = raw[center]
+        pts = raw
+        for _ in range(passes):
+            pts = laplacian_passes(pts, 1, step)
+            deviation = points_to_segments_distance(pts[center:center + 1], raw[:-1], raw[1:]).min()
+            if deviation > max_deviation:
+                break
+            best = pts[center]
+        return tuple(best)
+    
+    for point in points:
+        point = np.asarray(point, dtype=float)
+        if previous is not None and np.linalg.norm(point - previous) <= tol:
+            continue
+        previous = point
+        window.append(point)
+        received += 1
+        
+        # A point can go out once lag points after it have arrived
+        if received - emitted > lag:
+            yield smooth_one(emitted)
+            emitted += 1
+    
+    # End of the feed: the rest, with less and less context on the right
+    while emitted < received:
+        yield smooth_one(emitted)
+        emitted += 1
+
+
+
+def _wrap_angle(angle):
+    """Angle(s) moved into [-pi, pi)."""
+    return (angle + np.pi) % (2*np.pi) - np.pi
+
+
+
+class PolylineProfiles:
+    """
+    Arc length, direction, heading, signed curvature and curvature rate at
+    every vertex of many polylines, all at once (no loop over lanes).
+    
+    points: all lanes back to back in one (N, D) array, lane k is
+    points[offsets[k]:offsets[k+1]] (like smooth_lanes_parallel).
+    Tangents are central differences (one-sided at the lane ends, so the
+    end tangent is the last segment's direction). window=w fits them by
+    least squares over the w vertices on each side instead, which is a lot
+    less noisy on raw traces. Heading and curvature are in the x, y plane
+    (left turn = positive curvature); tangents keep all coordinates.
+    Derivatives along s are central differences too, never across lanes.
+    Lanes with 1 point (or zero-length steps) get nan.
+    """
+
+    def __init__(self, points, offsets, window=None):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        pts = self.points
+        n = len(pts)
+        
+        # Lane of every vertex and its neighbours in the same lane (itself at the ends)
+        counts = np.diff(self.offsets)
+        self.lane = np.repeat(np.arange(len(counts)), counts)
+        index = np.arange(n)
+        self.first = self.offsets[:-1]
+        self.last = self.offsets[1:] - 1
+        self.prev = np.maximum(index - 1, self.first[self.lane])
+        self.next = np.minimum(index + 1, self.last[self.lane])
+        
+        # Arc length from the start of each lane
+        steps = np.zeros(n)
+        steps[1:] = np.linalg.norm(np.diff(pts, axis=0), axis=1)
+        steps[self.first[counts > 0]] = 0.0
+        total = np.cumsum(steps)
+        self.arc_length = total - np.repeat(total[self.first[counts > 0]], counts[counts > 0])
+        
+        if window is None:
+            tangents = pts[self.next] - pts[self.prev]
+        else:
+            tangents = self._fit_tangents(int(window))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.tangents = tangents / np.linalg.norm(tangents, axis=1, keepdims=True)
+        
+        self.heading = np.arctan2(self.tangents[:, 1], self.tangents[:, 0])
+        self.curvature = self.derivative(self.heading, angle=True)
+        self.curvature_rate = self.derivative(self.curvature)
+
+    @classmethod
+    def from_polylines(cls, polylines, window=None):
+        """Same, from a list of polylines (one per lane)."""
+        polylines = [np.asarray(polyline, dtype=float) for polyline in polylines]
+        offsets = np.concatenate(([0], np.cumsum([len(polyline) for polyline in polylines])))
+        return cls(np.concatenate(polylines), offsets, window)
+
+    def derivative(self, values, angle=False):
+        """d(values)/ds at every vertex (angle=True: differences wrapped to [-pi, pi))."""
+        change = values[self.next] - values[self.prev]
+        if angle:
+            change = _wrap_angle(change)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return change / (self.arc_length[self.next] - self.arc_length[self.prev])
+
+    def _fit_tangents(self, window):
+        """dp/ds from a least squares line over vertices i-window .. i+window of the same lane."""
+        pts, arc = self.points, self.arc_length
+        index = np.arange(len(pts))
+        lo, hi = self.first[self.lane], self.last[self.lane]
+        
+        # Sums over the window, relative to vertex i (keeps the numbers small)
+        count = np.zeros(len(pts))
+        sum_s = np.zeros(len(pts))
+        sum_ss = np.zeros(len(pts))
+        sum_p = np.zeros_like(pts)
+        sum_sp = np.zeros_like(pts)
+        for shift in range(-window, window + 1):
+            j = np.clip(index + shift, lo, hi)
+            inside = (index + shift >= lo) & (index + shift <= hi)
+            ds = np.where(inside, arc[j] - arc, 0.0)
+            dp = np.where(inside[:, None], pts[j] - pts, 0.0)
+            count += inside
+            sum_s += ds
+            sum_ss += ds*ds
+            sum_p += dp
+            sum_sp += ds[:, None]*dp
+        
+        # slope = (count*sum_sp - sum_s*sum_p) / (count*sum_ss - sum_s^2), the
+        # denominator is > 0 and only the direction is kept anyway
+        return count[:, None]*sum_sp - sum_s[:, None]*sum_p
+
+
+
+def connection_metrics(profiles, from_lane, to_lane):
+    """
+    C0 gap, C1 angle (degrees) and C2 curvature jump (1/m) for arrays of
+    (lane end, next lane start) pairs, read off a PolylineProfiles.
+    Angle / jump are nan where a direction / curvature is unknown.
+    """
+    end = profiles.last[from_lane]
+    start = profiles.first[to_lane]
+    gap = np.linalg.norm(profiles.points[end] - profiles.points[start], axis=-1)
+    dot = np.einsum('...i,...i->...', profiles.tangents[end], profiles.tangents[start])
+    angle = np.degrees(np.arccos(np.clip(dot, -1, 1)))
+    curvature_jump = np.abs(profiles.curvature[end] - profiles.curvature[start])
+    return gap, angle, curvature_jump
+
+
+
+# One row per candidate connection, see audit_connections
+connection_dtype = np.dtype([
+    ("from_lane", np.int64),   # lane whose end ...
+    ("to_lane", np.int64),     # ... is near this lane's start
+    ("gap", np.float64),       # C0 [m]
+    ("angle", np.float64),     # C1 [deg], nan if a direction is unknown
+    ("curvature_jump", np.float64),  # C2 [1/m], nan if a curvature is unknown
+    ("c0_ok", np.bool_),
+    ("c1_ok", np.bool_),
+    ("c2_ok", np.bool_),
+])
+
+
+
+def audit_connections(polylines, radius=0.5, c0_tol=0.1, c1_tol=15.0, c2_tol=0.05,
+                      violations_only=False, window=None):
+    """
+    Part B for a whole map: find which lanes connect and check them all.
+    
+    All lane start points go in a SegmentIndex (as zero-length segments),
+    every lane end is matched with the starts within radius, and then
+    C0/C1/C2 of all the pairs are computed in one go (connection_metrics
+    on one PolylineProfiles of all lanes, window is passed on to it).
+    Returns a connection_dtype array (only failing pairs if violations_only).
+    """
+    profiles = PolylineProfiles.from_polylines(polylines, window)
+    starts = profiles.points[profiles.first]
+    ends = profiles.points[profiles.last]
+    
+    # Each start point as a degenerate polyline = one zero-length segment
+    index = SegmentIndex(np.stack([starts, starts], axis=1),
+                         cell_size=max(radius, 1e-9))
+    from_lane, to_lane, _ = index.within(ends, radius)
+    
+    # A lane ending where it starts (loop) is not a connection
+    other = from_lane != to_lane
+    from_lane, to_lane = from_lane[other], to_lane[other]
+    
+    gap, angle, curvature_jump = connection_metrics(profiles, from_lane, to_lane)
+    
+    result = np.empty(len(from_lane), dtype=connection_dtype)
+    result["from_lane"] = from_lane
+    result["to_lane"] = to_lane
+    result["gap"] = gap
+    result["angle"] = angle
+    result["curvature_jump"] = curvature_jump
+    result["c0_ok"] = gap < c0_tol
+    result["c1_ok"] = angle < c1_tol
+    result["c2_ok"] = curvature_jump < c2_tol
+    
+    if violations_only:
+        result = result[~(result["c0_ok"] & result["c1_ok"] & result["c2_ok"])]
+    return result
+
+
+
 def check_connection(lane1, lane2):
-    """Part B: Check C0 and C1 continuity"""
+    """Part B: Check C0 and C1 continuity (and C2)
     
-    l1 = [np.array(p) for p in lane1]
-    l2 = [np.array(p) for p in lane2]
+    (the numbers come from connection_metrics, same as audit_connections)
+    """
+    
+    profiles = PolylineProfiles.from_polylines([lane1, lane2])
+    gap, angle, curvature_jump = connection_metrics(profiles, 0, 1)
+    gap = float(gap)
     
     # C0: position check
-    gap = np.linalg.norm(l1[-1] - l2[0])
     print(f"\nC0 (Position): gap = {gap:.4f}m")
     if gap < 0.1:
         print("  ✓ Continuous (gap < 0.1m)")
     else:
         print("  ✗ Discontinuous")
     
-    # C1: direction check
-    angle = None
-    if len(l1) >= 2 and len(l2) >= 2:
-        # Last direction of lane1
-        dir1 = l1[-1] - l1[-2]
-        len1 = np.linalg.norm(dir1)
-        
-        # First direction of lane2
-        dir2 = l2[1] - l2[0]
-        len2 = np.linalg.norm(dir2)
-        
-        if len1 > 0 and len2 > 0:
-            dir1 = dir1 / len1
-            dir2 = dir2 / len2
-            
-            dot = np.dot(dir1, dir2)
-            angle = np.arccos(np.clip(dot, -1, 1)) * 180 / np.pi
-            
-            print(f"C1 (Direction): angle = {angle:.1f}°")
-            if angle < 15:
-                print("  ✓ Continuous (angle < 15°)")
-            else:
-                print("  ✗ Discontinuous")
+    # C1: direction check (last direction of lane1 vs first direction of lane2)
+    if np.isnan(angle):
+        return gap, None
+    angle = float(angle)
+    
+    print(f"C1 (Direction): angle = {angle:.1f}°")
+    if angle < 15:
+        print("  ✓ Continuous (angle < 15°)")
+    else:
+        print("  ✗ Discontinuous")
+    
+    # C2: curvature at the end of lane1 vs the start of lane2 (x, y plane)
+    if not np.isnan(curvature_jump):
+        print(f"C2 (Curvature): jump = {float(curvature_jump):.3f} 1/m")
+        if curvature_jump < 0.05:
+            print("  ✓ Continuous (jump < 0.05 1/m)")
+        else:
+            print("  ✗ Discontinuous")
     
     return gap, angle
 
@@ -274,27 +1277,36 @@ def make_plots(original, smoothed, lane2):
 
 
 
-# Main
-print("-"*50)
-print("TASK 3: LANE SMOOTHING AND CONTINUITY")
-print("-"*50)
+# Main (guarded, so process pool workers can import this file)
+if __name__ == "__main__":
+    print("-"*50)
+    print("TASK 3: LANE SMOOTHING AND CONTINUITY")
+    print("-"*50)
+
+    print("\nOriginal lane A has", len(lane_a), "points")
 
-print("\nOriginal lane A has", len(lane_a), "points")
+    print("\nPART A: Smoothing")
+    print("-"*30)
+    smoothed = smooth_lane(lane_a, max_deviation=0.3)
+    simplified = simplify_polyline(smoothed, max_deviation=0.05)
+    print(f"Simplified smoothed lane: {len(smoothed)} -> {len(simplified)} points (within 0.05m)")
 
-print("\nPART A: Smoothing")
-print("-"*30)
-smoothed = smooth_lane(lane_a, max_deviation=0.3)
+    # Slow trace: every step is under tol, it should be thinned, not dropped
+    slow_trace = np.column_stack([np.arange(100)*0.01, np.zeros(100)])
+    thinned = remove_duplicates(slow_trace, tol=0.02)
+    print(f"Slow trace (steps of 0.01m, tol 0.02m): {len(slow_trace)} -> {len(thinned)} points, "
+          f"still reaches {thinned[-1, 0]:.2f}m")
 
-print("\nPART B: Continuity Check")
-print("-"*30)
-gap, angle = check_connection(smoothed, lane_b)
+    print("\nPART B: Continuity Check")
+    print("-"*30)
+    gap, angle = check_connection(smoothed, lane_b)
 
-print("\nGenerating plots...")
-make_plots(lane_a, smoothed, lane_b)
+    print("\nGenerating plots...")
+    make_plots(lane_a, smoothed, lane_b)
 
-print("\nResults saved to smoothing.png")
-print(f"\nSummary:")
-print(f"- Max deviation allowed: 0.3m")
-print(f"- Final gap at junction: {gap:.4f}m")
-if angle:
-    print(f"- Angle between segments: {angle:.1f}°")
\ No newline at end of file
+    print("\nResults saved to smoothing.png")
+    print(f"\nSummary:")
+    print(f"- Max deviation allowed: 0.3m")
+    print(f"- Final gap at junction: {gap:.4f}m")
+    if angle:
+        print(f"- Angle between segments: {angle:.1f}°")
\ No newline at end of file